@@ -0,0 +1,38 @@
+import os
+import sys
+
+# the task directories hold the same copies of the shared modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "step_operator_prediction"))
+
+from tinypy_generation_driver import build_snippet_index, build_snippet_dedup_index, SnippetCorpus
+
+
+
+#____________________Hyper Parameters________________________#
+source_file_path = "sample_snippets.txt"
+index_path = None # where to write the offset index (None writes it next to the snippets file, as source_file_path + ".idx", where the scripts look for it)
+dedup_index = False # also build the dedup index of the snippets (next to the offset index, as index_path + ".dedup"), read by the runs with deduplicate_snippets
+snippet_dedup_on_disk = False # keep the hashes of the snippets in a temporary sqlite file instead of in memory while the dedup index is built
+#____________________Utility Functions________________________#
+
+# build the offset index of a snippets file : the (start, end) byte offsets of every snippet, as an array of
+# unsigned 64 bit integers (16 bytes per snippet), so that a script can read snippet k without reading the ones before it
+# set the snippet_index_path hyperparameter of the scripts to the index to use it
+# the dedup index holds, for every snippet, the index of the first snippet that is the same up to whitespace (8 bytes per snippet) :
+# building it before the nodes of a multi node run start ("--shard i/N") saves each of them from building it on its own
+
+
+#__________________MAIN_________________________
+
+
+if __name__ =="__main__":
+    if len(sys.argv) > 1:
+        source_file_path = sys.argv[1]
+    if len(sys.argv) > 2:
+        index_path = sys.argv[2]
+    index_path = build_snippet_index(source_file_path, index_path)
+    with SnippetCorpus(source_file_path, index_path) as corpus:
+        print(f"indexed {len(corpus)} snippets of {source_file_path} into {index_path} ({os.path.getsize(index_path)} bytes)")
+        if dedup_index:
+            dedup_index_path = build_snippet_dedup_index(corpus, on_disk=snippet_dedup_on_disk)
+            print(f"wrote the dedup index of {source_file_path} to {dedup_index_path} ({os.path.getsize(dedup_index_path)} bytes)")
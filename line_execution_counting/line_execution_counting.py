@@ -1,16 +1,36 @@
-import os
 import ast
-import random
 import sys
-from tqdm import tqdm
 from io import StringIO
 from contextlib import redirect_stdout
+from functools import lru_cache
+from itertools import islice
+from tinypy_code_tracer_engine import compile_snippet, trace_code, is_tinypy_subset, snippet_budget, BudgetExceeded
+from tinypy_generation_driver import process_in_order, TaskRun
+from tinypy_interpreter import compile_tinypy, run_snippet
 
 
 
 #____________________Hyper Parameters________________________#
+# the hyperparameters the driver reads (source_file_path, workers, output_shards ..etc) are described in tinypy_generation_driver.py (see Task scripts)
 source_file_path = "sample_snippets.txt"
+snippet_index_path = None
 destination_file_path = "line_execution_counting.txt"
+output_shards = 0
+deduplicate_snippets = False
+snippet_dedup_on_disk = False
+tracing_backend = "auto" # "auto", "monitoring" or "settrace" ("auto" uses sys.monitoring on python 3.12+, sys.settrace otherwise)
+line_counting_mode = "auto" # "auto", "interpreter" (snippets compiled into closures, see tinypy_interpreter.py, not checked against the traced counts), "instrumented" or "traced"
+max_snippet_steps = 1000000
+max_snippet_seconds = 10 # the runs without line events (the validation run on CPython, the "instrumented" counts) are only stopped by a SIGALRM timer, which only exists on unix in the main thread, elsewhere they can go past it
+workers = 1
+chunk_size = 64
+sandboxed_workers = False
+worker_memory_limit_mb = 2048
+worker_cpu_limit_seconds = 60
+snippets_per_worker = 1000
+trace_store_path = None
+rejection_index_path = None
+verification_sample_size = 1000 # in "auto" mode, how many snippets (the first ones of the source file) are counted both ways before the run, to check the instrumented counts
 #____________________Utility Functions________________________#
 
 def line_counter(code_snippet):
@@ -24,66 +44,167 @@ def line_counter(code_snippet):
         """
         counter = 0
 
-        def trace_lines(frame, event, arg):
+        def trace_lines(frame, lineno):
             nonlocal counter # declaring the outer variable
-            if event == 'line': # every time the tracer detects the execution of a line of code
-                filename = frame.f_code.co_filename
-                if filename == '<string>' : # counting only the lines that are in the code snippet we provided "and not in some other internal libraries"
-                    counter += 1 # increment the global counter
-            return trace_lines
+            # every time the tracer detects the execution of a line of code
+            # only the lines of the code snippet we provided are reported "and not lines in some other internal libraries"
+            counter += 1 # increment the global counter
 
 
-        # Set the trace function
-        sys.settrace(trace_lines)
-
         # Capture the output of the program.
         SIO = StringIO()
         with redirect_stdout(SIO):
-            # executing the code, the execution is being traced by the trace_lines() function that has been set previously
-            exec(code_snippet,{'__file__': '<string>'}) # Execute the code and setting the "fake file" name to <string> so that we can recognise this code snippet later in trace_lines()
-
-        # Disable the trace function
-        sys.settrace(None)
+            # executing the code, the execution is being traced by the trace_lines() function (the tracer is removed once the execution ends)
+            trace_code(compile_snippet(code_snippet), {'__file__': '<string>'}, trace_lines, tracing_backend)
 
         return counter
 
 
+COUNTER_NAME = "__executed_lines__" # name of the counter inserted in instrumented snippets
+
+
+def instrument_block(body, extra_lines=0):
+    # given a list of statements, return the same list preceded by a single
+    # counter increment covering all of them (without jumps, all the statements of a block run together)
+    # extra_lines is used by loop bodies to count the loop header being evaluated again after every iteration
+    for stmt in body:
+        if isinstance(stmt, (ast.For, ast.While)):
+            stmt.body = instrument_block(stmt.body, extra_lines=1)
+        elif isinstance(stmt, ast.If):
+            stmt.body = instrument_block(stmt.body)
+        if isinstance(stmt, (ast.If, ast.For, ast.While)) and stmt.orelse:
+            stmt.orelse = instrument_block(stmt.orelse)
+    increment = ast.AugAssign(
+        target=ast.Name(id=COUNTER_NAME, ctx=ast.Store()),
+        op=ast.Add(),
+        value=ast.Constant(value=len(body) + extra_lines),
+    )
+    return [increment] + body
+
+
+@lru_cache(maxsize=256)
+def compile_instrumented(code_snippet):
+    # given a code snippet, return a compiled version of it that counts its own
+    # executed lines in the COUNTER_NAME global, or None if the snippet can not be instrumented
+    # (a snippet without any statement counts a single line when traced, it is left to line_counter())
+    tree = ast.parse(code_snippet)
+    if not tree.body or not is_tinypy_subset(tree):
+        return None
+    tree.body = instrument_block(tree.body)
+    ast.fix_missing_locations(tree)
+    return compile(tree, '<string>', 'exec')
+
+
+def instrumented_line_counter(code_snippet):
+    """
+    counts the executed lines following the same rules as line_counter()
+    but by running an instrumented copy of the snippet without any tracer :
+        - every block starts by adding its number of statements to a counter
+        - loop bodies add one more line for the loop header being evaluated again
+    snippets that can not be instrumented are counted by line_counter()
+    """
+    code = compile_instrumented(code_snippet)
+    if code is None:
+        return line_counter(code_snippet)
+    env = {'__file__': '<string>', COUNTER_NAME: 0}
+    SIO = StringIO()
+    with redirect_stdout(SIO):
+        exec(code, env)
+    return env[COUNTER_NAME]
+
+
+def interpreter_line_counter(code_snippet):
+    # counts the executed lines following the same rules as line_counter()
+    # by running the snippet through the tinypy interpreter, which reports every line without any tracer
+    # snippets outside the tinypy subset are counted by line_counter()
+    program = compile_tinypy(code_snippet)
+    if program is None:
+        return line_counter(code_snippet)
+    SIO = StringIO()
+    with redirect_stdout(SIO):
+        return program.count_lines()
+
+
+instrumented_counts_rejected = False # whether an instrumented count of the verification sample differed from the traced one ("auto" mode), set for the run by prepare_run()
+
+
+def verify_snippet(index, snippet):
+    # count the executed lines of a snippet of the verification sample both ways, returns ([whether the counts match], status, reason)
+    # a snippet that fails to run (or goes over its budget) is left out of the verification
+    try:
+        with snippet_budget(max_snippet_steps, max_snippet_seconds):
+            matches = instrumented_line_counter(snippet) == line_counter(snippet)
+    except BudgetExceeded:
+        return [], "over_budget", "over its step/time budget"
+    except Exception as error:
+        return [], "invalid", "fails to run : "+type(error).__name__
+    return [matches], "ok", ""
+
+
+def crashed_verification_result(index, snippet):
+    # result of a snippet of the verification sample that crashed its sandboxed worker
+    return [], "crashed", "crashed its worker"
+
+
+def prepare_run(snippets, workers=1, sandbox=None):
+    # called by the driver with the snippets of the source file before any example is generated (see TaskRun) :
+    # in "auto" mode, count the first verification_sample_size snippets both ways, the instrumented engine is then used for the whole run if all of them matched,
+    # the traced one otherwise (done once before the run, the choice is sent to every worker and shard as the instrumented_counts_rejected hyperparameter)
+    if line_counting_mode != "auto":
+        return {}
+    sample = list(islice(snippets, verification_sample_size))
+    rejected = False
+    for matches, _, _ in process_in_order(verify_snippet, sample, workers, chunk_size, desc="Verifying the instrumented counts", sandbox=sandbox, crashed_result=crashed_verification_result):
+        if matches == [False]:
+            rejected = True
+    if rejected:
+        print("instrumented line count differs from the traced one, falling back to tracing for this run")
+    return {"instrumented_counts_rejected": rejected}
+
+
+def count_executed_lines(code_snippet):
+    # count the executed lines of a snippet with the engine picked by line_counting_mode
+    # in "auto" mode, the engine picked by prepare_run()
+    if line_counting_mode == "traced":
+        return line_counter(code_snippet)
+    if line_counting_mode == "instrumented":
+        return instrumented_line_counter(code_snippet)
+    if line_counting_mode == "interpreter":
+        return interpreter_line_counter(code_snippet)
+    if line_counting_mode != "auto":
+        raise ValueError(f"unknown line counting mode {line_counting_mode!r}")
+    if instrumented_counts_rejected:
+        return line_counter(code_snippet)
+    return instrumented_line_counter(code_snippet)
+
+
 def generate_line_execution_count_snippet(code_snippet):
     # given a code_snippet, build a line execution count snippet
     # by appending to the existing code comments including
     # the number of lines executed 
 
-    count = line_counter(code_snippet)
+    count = count_executed_lines(code_snippet)
     return code_snippet + "\n# " + "count?"+str(count)
 
 
+def validate_snippet(snippet):
+    # run the snippet once, raising the error of a snippet that fails to run, the run is shared with the generation (see shared_runs())
+    run_snippet(snippet, "interpreter" if line_counting_mode == "interpreter" else "cpython")
+
+
+def generate_examples(index, snippet):
+    # the training examples of the snippet at position index of the source file (see TaskRun in tinypy_generation_driver.py)
+    generated_sample = generate_line_execution_count_snippet(snippet)
+    return [] if generated_sample == None else [generated_sample]
+
+
+def get_rejection_scope(index):
+    # the hyperparameters the rejections of the task depend on (see RejectionIndex)
+    return repr(("line_execution_counting", max_snippet_steps, max_snippet_seconds))
+
+
 #__________________MAIN_________________________
 
 
 if __name__ =="__main__":
-
-    print("--- Splitting original file content ---\n")
-    with open(source_file_path, 'r', encoding='utf-8') as f:
-        # read the file
-        content = f.read()
-        
-        # extract the code snippets in the form of a list
-        snippet_list = content.split('\n\n')
-
-        # --- Output Results ---
-        print(f"Successfully split the file into {len(snippet_list)} snippets.")
-
-    transformed_snippets = []
-    for snippet in tqdm(snippet_list, desc="Processing Snippets"):
-        try:
-            exec(snippet, {})
-            generated_sample = generate_line_execution_count_snippet(snippet)
-            if generated_sample  != None:
-                transformed_snippets.append(generated_sample)
-        except Exception as e:
-            continue  # skip invalid snippet
-
-    print("Writing...")
-    with open(destination_file_path, "w", encoding="utf-8") as f:
-        f.write("\n\n".join(transformed_snippets))
-    print("Done, sucessfully written to :"+destination_file_path)
\ No newline at end of file
+    TaskRun().run(sys.argv[1:])
@@ -1,4 +1,8 @@
+import os
 import re
+import bz2
+import gzip
+import lzma
 import struct
 from tqdm import tqdm
 
@@ -49,26 +53,53 @@ class TinypyTokenizer():
 	def decode(self, tokens_ids):
 		return [self.decod_map[id] for id in tokens_ids]
 
+	def read_examples(self, input_file_path:str, read_size:int=1 << 20):
+		# yield the examples of a dataset one by one, the same ones open(input_file_path).read().split('\n\n')[:-1] gives,
+		# reading the file read_size characters at a time instead of all at once
+		with open_compressed(input_file_path, 'r') as f:
+			pending = ''
+			while True:
+				block = f.read(read_size)
+				if not block:
+					break
+				examples = (pending + block).split('\n\n')
+				pending = examples.pop()
+				yield from examples
+		# We leave out the text after the last separator because it is an emtpy string
+
 	def encode_to_file(self, input_file_path:str, output_file_path:str):
-		print('loading', input_file_path, '...')
-		with open(input_file_path, 'r') as f:
-			examples_string  = f.read()
-		print('splitting the examples ...')
-		examples = examples_string.split('\n\n')[:-1] # We remove the last element of the list because it is an emtpy string
-		output_file = open(output_file_path, 'wb')
-		for example in tqdm(examples):
-			# tokenizing
-			example = example + '\n\n'
-			tokenized_example = self.tokenize(example)
-			
-			# Encoding and writing the token_ids of the example
-			# We put it inside a try catch block in case there are keywords that
-			# we are not considering in the tokens_list so we can identify them
-			try:
-				for token in tokenized_example:
-					token_id = self.encod_map[token]
-					output_file.write(struct.pack('B', token_id))
-			except Exception:
-				return(f"error token:{token}")
-		output_file.close()
-		return None
\ No newline at end of file
+		# the examples are streamed from input_file_path to output_file_path, either of them being
+		# (de)compressed on the fly when it ends with '.gz', '.xz' or '.bz2' (see open_compressed())
+		print('encoding', input_file_path, '...')
+		with open_compressed(output_file_path, 'wb') as output_file:
+			for example in tqdm(self.read_examples(input_file_path)):
+				# tokenizing
+				example = example + '\n\n'
+				tokenized_example = self.tokenize(example)
+				
+				# Encoding and writing the token_ids of the example
+				# We put it inside a try catch block in case there are keywords that
+				# we are not considering in the tokens_list so we can identify them
+				token_ids = bytearray()
+				try:
+					for token in tokenized_example:
+						token_id = self.encod_map[token]
+						token_ids += struct.pack('B', token_id)
+				except Exception:
+					output_file.write(token_ids)
+					return(f"error token:{token}")
+				output_file.write(token_ids)
+		return None
+
+
+def open_compressed(path:str, mode:str='r'):
+	# open a file like open(path, mode) does, a '.gz', '.xz' or '.bz2' file being (de)compressed on the fly
+	extension = os.path.splitext(path)[1].lower()
+	text_mode = mode if 'b' in mode else mode + 't'
+	if extension == '.gz':
+		return gzip.open(path, text_mode)
+	if extension == '.xz':
+		return lzma.open(path, text_mode)
+	if extension == '.bz2':
+		return bz2.open(path, text_mode)
+	return open(path, mode)
\ No newline at end of file
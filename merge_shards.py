@@ -0,0 +1,35 @@
+import os
+import sys
+
+# the task directories hold the same copies of the shared modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "step_operator_prediction"))
+
+from tinypy_generation_driver import merge_shards
+
+
+
+#____________________Hyper Parameters________________________#
+shard_count = 4 # number of shards the datasets were split into (N of the "--shard i/N" runs, or output_shards)
+destination_file_paths = [ # datasets to rebuild out of their shards (the shards and their manifests are read next to them)
+    "step_operator_prediction/stepped_operator_prediction.txt",
+]
+#____________________Utility Functions________________________#
+
+# a large snippets file can be split over several machines without any coordination : every machine runs
+# the same script with "--shard i/N" (i from 0 to N-1), which only generates the examples of shard i of the snippets
+# (ranges of consecutive snippets, computed the same way on every machine from the snippet index)
+# once the shards (and their manifests) are gathered in the same directory, this joins them back into the dataset
+# and the log a single machine would have written, byte for byte, after checking them against their manifests
+# usage : python merge_shards.py N path/to/dataset.txt [other datasets ..]
+
+
+#__________________MAIN_________________________
+
+
+if __name__ =="__main__":
+    if len(sys.argv) > 2:
+        shard_count = int(sys.argv[1])
+        destination_file_paths = sys.argv[2:]
+    for destination_file_path in destination_file_paths:
+        shards = merge_shards(destination_file_path, shard_count)
+        print(f"merged {len(shards)} shards ({sum(shard['examples'] for shard in shards)} examples) into {destination_file_path}")
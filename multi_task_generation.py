@@ -0,0 +1,60 @@
+import os
+import sys
+import importlib
+
+
+#____________________Tasks________________________#
+
+# (task directory, script of the task)
+TASKS = (
+    ("line_execution_counting", "line_execution_counting"),
+    ("operator_prediction", "operator_prediction"),
+    ("output_prediction", "output_prediction"),
+    ("step_input_prediction", "stepped_input_prediction"),
+    ("step_operator_prediction", "step_operator_prediction"),
+)
+ROOT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# the task directories hold the same copies of the shared modules, the first one found is used by every task
+for task_directory, _ in reversed(TASKS):
+    sys.path.insert(0, os.path.join(ROOT_DIRECTORY, task_directory))
+
+from tinypy_generation_driver import TaskRun
+
+
+
+#____________________Hyper Parameters________________________#
+# the hyperparameters of the run are described in tinypy_generation_driver.py (see Task scripts), those of the task scripts are not used here
+source_file_path = "sample_snippets.txt"
+snippet_index_path = None
+enabled_tasks = { # which datasets to generate, each one is written to the destination_file_path of its task (inside the task directory)
+    "line_execution_counting": True,
+    "operator_prediction": True,
+    "output_prediction": True,
+    "step_input_prediction": True,
+    "step_operator_prediction": True,
+}
+workers = 1
+chunk_size = 64
+output_shards = 0
+deduplicate_snippets = False
+snippet_dedup_on_disk = False
+sandboxed_workers = False
+worker_memory_limit_mb = 2048
+worker_cpu_limit_seconds = 60
+snippets_per_worker = 1000
+trace_store_path = None
+# every other hyperparameter (budgets, sampling, seed, engines, rejection index ..etc) is read from the script of each task
+#____________________Utility Functions________________________#
+
+# the datasets of every enabled task are generated out of a single pass over the snippets, each snippet being parsed,
+# validated and run once for all of them (see TaskRun.process_snippet()), giving the very files the script of each task writes
+task_scripts = {task_directory: importlib.import_module(script) for task_directory, script in TASKS if enabled_tasks.get(task_directory)}
+task_run = TaskRun(__name__, {task_directory: script.__name__ for task_directory, script in task_scripts.items()}, ROOT_DIRECTORY)
+
+
+#__________________MAIN_________________________
+
+
+if __name__ =="__main__":
+    task_run.run(sys.argv[1:])
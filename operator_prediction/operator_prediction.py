@@ -2,15 +2,36 @@ import os
 import ast
 import random
 import sys
-from tqdm import tqdm
+from tinypy_code_tracer_engine import compile_snippet, trace_code
+from tinypy_generation_driver import get_snippet_rng, TaskRun
+from tinypy_interpreter import compile_tinypy, execute_snippet, run_snippet, get_shared_run
 
 
 
 #____________________Hyper Parameters________________________#
+# the hyperparameters the driver reads (source_file_path, workers, output_shards ..etc) are described in tinypy_generation_driver.py (see Task scripts)
 source_file_path = "sample_snippets.txt"
+snippet_index_path = None
 destination_file_path = "operator_prediction.txt"
+output_shards = 0
+deduplicate_snippets = False
+snippet_dedup_on_disk = False
 include_arithmetic_masking = True
 include_comparator_masking = False
+tracing_backend = "auto" # "auto", "monitoring" or "settrace" ("auto" uses sys.monitoring on python 3.12+, sys.settrace otherwise)
+execution_engine = "cpython" # "cpython" or "interpreter" (snippets compiled into closures, see tinypy_interpreter.py), snippets outside the tinypy subset always run on CPython
+max_snippet_steps = 1000000
+max_snippet_seconds = 10 # the runs on CPython (execution_engine = "cpython", or snippets outside the tinypy subset) have no line events and are only stopped by a SIGALRM timer, which only exists on unix in the main thread, elsewhere they can go past it
+workers = 1
+chunk_size = 64
+sandboxed_workers = False
+worker_memory_limit_mb = 2048
+worker_cpu_limit_seconds = 60
+snippets_per_worker = 1000
+seed = 0
+snippet_rng_key = "index"
+trace_store_path = None
+rejection_index_path = None
 OPPOSITE_OPERATORS = {
     '<': '>',
     '>': '<',
@@ -50,13 +71,10 @@ def get_variable_values_from_code(code_snippet):
     # We execute the code in a controlled environment to capture the final
     # state of the variables.
     
-    # This dictionary will act as the local scope for the executed code.
-    local_scope = {}
     try:
-        # The exec() function runs the Python code. The second argument
-        # is the global scope (we leave it empty) and the third is the
-        # local scope, which will be populated by the code.
-        exec(code_snippet, {}, local_scope)
+        # execute_snippet() runs the code like exec(code, {}, local_scope) would
+        # and returns the local scope populated by the code.
+        local_scope = execute_snippet(code_snippet, execution_engine)
     except Exception as e:
         return None
 
@@ -98,20 +116,18 @@ def get_verified_lines(code):
     # lines that are not reached include lines within if-blocks 
     # that have a 'false' condition
 
+    # the interpreter reports the executed lines without any tracer
+    program = compile_tinypy(code) if execution_engine == "interpreter" else None
+    if program is not None:
+        return program.executed_lines()
+
     # using a set() to avoid redunduncy
     verified_lines = set()
 
-    def trace_lines(frame, event, arg):
-        if event == "line":
-            lineno = frame.f_lineno
-            verified_lines.add(lineno)
-        return trace_lines
+    def trace_lines(frame, lineno):
+        verified_lines.add(lineno)
 
-    sys.settrace(trace_lines)
-    try:
-        exec(code, {})
-    finally:
-        sys.settrace(None)
+    trace_code(compile_snippet(code), {}, trace_lines, tracing_backend)
 
     return verified_lines
 
@@ -194,7 +210,7 @@ def replace_operator_with_symbol(code_snippet, op_col, op_line,symbol):
     return "\n".join(code_lines)
 
 
-def generate_operator_prediction_snippet(code_snippet, opposition_dictionary, limit = 0):
+def generate_operator_prediction_snippet(code_snippet, opposition_dictionary, limit = 0, rng = random):
     # given a code snippet, return all possible training instances
     # for the operator prediction task, in a list
 
@@ -202,7 +218,8 @@ def generate_operator_prediction_snippet(code_snippet, opposition_dictionary, li
     code_snippets = []
 
     # find all operators that can be masked
-    candidates= find_operators_to_replace(code_snippet)
+    # the candidates of a snippet are kept with its runs (see shared_runs()), a snippet already in the trace store is not traced again
+    candidates= get_shared_run(("operator_candidates", include_arithmetic_masking, include_comparator_masking), code_snippet, lambda: find_operators_to_replace(code_snippet))
 
 
     # check if there is any limit to how many instances extracted from the snippet
@@ -210,7 +227,7 @@ def generate_operator_prediction_snippet(code_snippet, opposition_dictionary, li
     if limit ==0 or limit>=len(candidates):
         selected = candidates
     else:
-        selected = random.sample(candidates, limit)
+        selected = rng.sample(candidates, limit)
 
     # get the variable states at the end of execution
     values = get_variable_values_from_code(code_snippet)
@@ -231,31 +248,25 @@ def generate_operator_prediction_snippet(code_snippet, opposition_dictionary, li
 
 
 
+def validate_snippet(snippet):
+    # run the snippet once, raising the error of a snippet that fails to run, the run is shared with the generation (see shared_runs())
+    run_snippet(snippet, execution_engine)
+
+
+def generate_examples(index, snippet):
+    # the training examples of the snippet at position index of the source file (see TaskRun in tinypy_generation_driver.py)
+    # the random choices of the snippet are drawn from its own generator (see seed/snippet_rng_key)
+    return generate_operator_prediction_snippet(snippet,OPPOSITE_OPERATORS,rng=get_snippet_rng(seed, index, snippet, snippet_rng_key))
+
+
+def get_rejection_scope(index):
+    # the hyperparameters the rejections of the task depend on (see RejectionIndex), along with the position
+    # of the snippet when its random choices depend on it
+    return repr(("operator_prediction", include_arithmetic_masking, include_comparator_masking, OPPOSITE_OPERATORS, seed, max_snippet_steps, max_snippet_seconds, index if snippet_rng_key == "index" else None))
+
+
 #__________________MAIN_________________________
 
 
 if __name__ =="__main__":
-
-    print("--- Splitting original file content ---\n")
-    with open(source_file_path, 'r', encoding='utf-8') as f:
-        # read the file
-        content = f.read()
-        
-        # extract the code snippets in the form of a list
-        snippet_list = content.split('\n\n')
-
-        # --- Output Results ---
-        print(f"Successfully split the file into {len(snippet_list)} snippets.")
-
-    transformed_snippets = []
-    for snippet in tqdm(snippet_list, desc="Processing Snippets"):
-        try:
-            exec(snippet, {})
-            transformed_snippets.extend(generate_operator_prediction_snippet(snippet,OPPOSITE_OPERATORS))
-        except Exception:
-            continue  # skip invalid snippet
-
-    print("Writing...")
-    with open(destination_file_path, "w", encoding="utf-8") as f:
-        f.write("\n\n".join(transformed_snippets))
-    print("Done, sucessfully written to :"+destination_file_path)
\ No newline at end of file
+    TaskRun().run(sys.argv[1:])
@@ -2,13 +2,30 @@ import os
 import ast
 import random
 import sys
-from tqdm import tqdm
+from tinypy_generation_driver import TaskRun
+from tinypy_interpreter import execute_snippet, run_snippet
 
 
 
 #____________________Hyper Parameters________________________#
+# the hyperparameters the driver reads (source_file_path, workers, output_shards ..etc) are described in tinypy_generation_driver.py (see Task scripts)
 source_file_path = "sample_snippets.txt"
+snippet_index_path = None
 destination_file_path = "output_prediction.txt"
+output_shards = 0
+deduplicate_snippets = False
+snippet_dedup_on_disk = False
+execution_engine = "cpython" # "cpython" or "interpreter" (snippets compiled into closures, see tinypy_interpreter.py), snippets outside the tinypy subset always run on CPython
+max_snippet_steps = 1000000
+max_snippet_seconds = 10 # the runs on CPython (execution_engine = "cpython", or snippets outside the tinypy subset) have no line events and are only stopped by a SIGALRM timer, which only exists on unix in the main thread, elsewhere they can go past it
+workers = 1
+chunk_size = 64
+sandboxed_workers = False
+worker_memory_limit_mb = 2048
+worker_cpu_limit_seconds = 60
+snippets_per_worker = 1000
+trace_store_path = None
+rejection_index_path = None
 #____________________Utility Functions________________________#
 
 
@@ -43,13 +60,10 @@ def get_variable_values_from_code(code_snippet):
     # We execute the code in a controlled environment to capture the final
     # state of the variables.
     
-    # This dictionary will act as the local scope for the executed code.
-    local_scope = {}
     try:
-        # The exec() function runs the Python code. The second argument
-        # is the global scope (we leave it empty) and the third is the
-        # local scope, which will be populated by the code.
-        exec(code_snippet, {}, local_scope)
+        # execute_snippet() runs the code like exec(code, {}, local_scope) would
+        # and returns the local scope populated by the code.
+        local_scope = execute_snippet(code_snippet, execution_engine)
     except Exception as e:
         return None
 
@@ -87,30 +101,24 @@ def generate_output_prediction_snippet(code_snippet):
     return None
 
 
-if __name__ =="__main__":
+def validate_snippet(snippet):
+    # run the snippet once, raising the error of a snippet that fails to run, the run is shared with the generation (see shared_runs())
+    run_snippet(snippet, execution_engine)
+
+
+def generate_examples(index, snippet):
+    # the training examples of the snippet at position index of the source file (see TaskRun in tinypy_generation_driver.py)
+    generated_sample = generate_output_prediction_snippet(snippet)
+    return [] if generated_sample == None else [generated_sample]
+
+
+def get_rejection_scope(index):
+    # the hyperparameters the rejections of the task depend on (see RejectionIndex)
+    return repr(("output_prediction", max_snippet_steps, max_snippet_seconds))
 
-    print("--- Splitting original file content ---\n")
-    with open(source_file_path, 'r', encoding='utf-8') as f:
-        # read the file
-        content = f.read()
-        
-        # extract the code snippets in the form of a list
-        snippet_list = content.split('\n\n')
-
-        # --- Output Results ---
-        print(f"Successfully split the file into {len(snippet_list)} snippets.")
-
-    transformed_snippets = []
-    for snippet in tqdm(snippet_list, desc="Processing Snippets"):
-        try:
-            exec(snippet, {})
-            generated_sample = generate_output_prediction_snippet(snippet)
-            if generated_sample  != None:
-                transformed_snippets.append(generated_sample)
-        except Exception:
-            continue  # skip invalid snippet
-
-    print("Writing...")
-    with open(destination_file_path, "w", encoding="utf-8") as f:
-        f.write("\n\n".join(transformed_snippets))
-    print("Done, sucessfully written to :"+destination_file_path)
\ No newline at end of file
+
+#__________________MAIN_________________________
+
+
+if __name__ =="__main__":
+    TaskRun().run(sys.argv[1:])
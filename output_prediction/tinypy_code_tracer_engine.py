@@ -0,0 +1,528 @@
+import ast
+import dis
+import sys
+import time
+import signal
+import threading
+from io import StringIO
+from contextlib import contextmanager, redirect_stdout
+from functools import lru_cache
+
+
+
+#____________________Hyper Parameters________________________#
+compile_cache_size = 256 # how many compiled code objects to keep around (a snippet and its harnesses only need a few)
+#____________________Compilation________________________#
+
+@lru_cache(maxsize=compile_cache_size)
+def compile_snippet(source, filename='<string>'):
+    # given a source text, return its compiled code object
+    # every execution of the same text (validation, line counting, tracing ..etc)
+    # reuses the cached code object instead of re-compiling the source
+    # the default filename is the same one exec() gives to raw strings
+    return compile(source, filename, 'exec')
+
+
+def build_function_source(code_snippet):
+    # given a code snippet, wrap it inside a "func" function
+    # so that it can be called and traced by the stepped harnesses
+    # line i of the snippet (0 based) ends up on line i+2 of the function source
+    indented = "\n".join([f"	{line}" for line in code_snippet.split("\n")])
+    return "def func():\n" + indented
+
+
+def exec_harness(code_snippet, stack, env, backend=None):
+    # execute a stepped harness "stack" over a code snippet in the environment env
+    # the snippet function and the harness are compiled separately, the harness
+    # template being the same for every snippet it is only compiled once per run
+    # the harness starts tracing "func" by calling trace_function(func, line_tracer)
+    env["trace_function"] = lambda func, line_tracer: trace_function(func, line_tracer, backend)
+    env["refresh_frame_locals"] = refresh_frame_locals
+    env["StepsCaptured"] = StepsCaptured
+    exec(compile_snippet(build_function_source(code_snippet)), env)
+    exec(compile_snippet(stack), env)
+
+
+#____________________Budget________________________#
+
+class BudgetExceeded(BaseException):
+    # raised when the snippet being processed goes over its step or time budget
+    # (it is not an Exception so that neither the snippet nor the usual error handling can swallow it)
+    pass
+
+
+class SnippetBudget():
+    """
+    step and time budget of the snippet being processed (see snippet_budget())
+    max_steps limits the line events of every single execution of the snippet (0 means no limit)
+    max_seconds limits the time spent on the snippet, all of its executions included (0 means no limit)
+    """
+    def __init__(self, max_steps=0, max_seconds=0):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.deadline = time.perf_counter() + max_seconds if max_seconds else None
+        self.use_alarm = False
+        self.finished = False # set once the block of the budget is over, a SIGALRM arriving afterwards is ignored
+
+    def check_time(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise BudgetExceeded(f"over the {self.max_seconds}s time budget")
+
+
+active_budget = None # budget of the snippet being processed, None outside of snippet_budget()
+
+
+def on_budget_alarm(signum, frame):
+    if active_budget is None or active_budget.finished:
+        return
+    raise BudgetExceeded(f"over the {active_budget.max_seconds}s time budget")
+
+
+@contextmanager
+def snippet_budget(max_steps=0, max_seconds=0):
+    # every execution of a snippet inside this block is stopped with BudgetExceeded once it goes
+    # over max_steps line events, or once the block has been running for more than max_seconds
+    # the time budget is enforced by a SIGALRM timer when possible (unix, main thread), which also
+    # stops plain exec() calls, otherwise it is only checked by the executions reporting line events
+    global active_budget
+    active_budget = SnippetBudget(max_steps, max_seconds)
+    use_alarm = bool(max_seconds) and hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+    active_budget.use_alarm = use_alarm
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, on_budget_alarm)
+        signal.setitimer(signal.ITIMER_REAL, max_seconds)
+    try:
+        yield active_budget
+    finally:
+        if use_alarm:
+            # the timer can go off after the block is over but before it is disarmed, that late alarm is not
+            # an error of the snippet (the handler ignores it once the budget is finished)
+            try:
+                active_budget.finished = True
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            except BudgetExceeded:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+        active_budget = None
+
+
+@contextmanager
+def budget_paused():
+    # the time spent inside this block (e.g. writing the runs of the snippet to a trace store) is not part
+    # of the time budget of the snippet being processed, and can not be interrupted by its SIGALRM timer
+    budget = active_budget
+    if budget is None or budget.deadline is None:
+        yield
+        return
+    remaining = signal.setitimer(signal.ITIMER_REAL, 0)[0] if budget.use_alarm else 0
+    paused_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        budget.deadline += time.perf_counter() - paused_at
+        if remaining:
+            signal.setitimer(signal.ITIMER_REAL, remaining)
+
+
+def limit_steps(step_callback):
+    # wrap a callback called on every line event of an execution so that the execution
+    # raises BudgetExceeded once it goes over the budget of the snippet being processed
+    budget = active_budget
+    if budget is None or not (budget.max_steps or budget.max_seconds):
+        return step_callback
+    max_steps = budget.max_steps
+    steps = 0
+
+    def budgeted_step(*args):
+        nonlocal steps
+        steps += 1
+        if max_steps and steps > max_steps:
+            raise BudgetExceeded(f"over the {max_steps} steps budget")
+        if steps % 1000 == 0:
+            budget.check_time()
+        return step_callback(*args)
+    return budgeted_step
+
+
+#____________________Tracing________________________#
+
+# "auto" and "monitoring" use sys.monitoring on python 3.12+ and fall back to sys.settrace on older interpreters
+TRACING_BACKENDS = ("auto", "monitoring", "settrace")
+
+monitoring_tool_id = None # sys.monitoring tool id claimed by the first monitored run
+
+
+class StepsCaptured(BaseException):
+    # raised by a line callback once every requested step has been captured, to stop the execution early
+    # the traced runs end cleanly on it (it is not an Exception so that the snippet can not catch it)
+    pass
+
+
+def resolve_tracing_backend(backend=None):
+    # given a backend name, return the backend that will actually be used
+    # ("monitoring" or "settrace") depending on what the interpreter supports
+    if backend is None:
+        backend = "auto"
+    if backend not in TRACING_BACKENDS:
+        raise ValueError(f"unknown tracing backend {backend!r}, expected one of {TRACING_BACKENDS}")
+    if backend == "settrace" or not hasattr(sys, "monitoring"):
+        return "settrace"
+    return "monitoring"
+
+
+def get_monitoring_tool_id():
+    # claim a free sys.monitoring tool id once, and keep it for the rest of the run
+    global monitoring_tool_id
+    if monitoring_tool_id is None:
+        for tool_id in range(6):
+            if sys.monitoring.get_tool(tool_id) is None:
+                sys.monitoring.use_tool_id(tool_id, "tinypy_code_tracer")
+                monitoring_tool_id = tool_id
+                break
+        else:
+            raise RuntimeError("no free sys.monitoring tool id")
+    return monitoring_tool_id
+
+
+def get_nested_codes(code):
+    # given a code object, return the set of it and of every code object nested in it
+    # (lambdas, comprehensions, generator expressions ..etc of a snippet, at any depth)
+    codes = {code}
+    for const in code.co_consts:
+        if isinstance(const, type(code)):
+            codes |= get_nested_codes(const)
+    return codes
+
+
+@lru_cache(maxsize=compile_cache_size)
+def has_monitored_line_events(code):
+    # whether sys.monitoring reports the same line events as sys.settrace for the code object "code" :
+    # it has no LINE event for the first line of a nested frame (a lambda or a generator expression
+    # on the line calling it), for the line a generator resumes on, nor for a loop jumping back to
+    # the line it is on (a comprehension inlined by python 3.12+, a single line loop ..etc)
+    # nor for a code object without any line (an empty or comment-only snippet), which sys.settrace reports once
+    if len(get_nested_codes(code)) > 1:
+        return False
+    if not any(line for _, _, line in code.co_lines()):
+        return False
+    lines = {}
+    for start, end, line in code.co_lines():
+        for offset in range(start, end, 2):
+            lines[offset] = line
+    for instruction in dis.get_instructions(code):
+        if instruction.opname.startswith("JUMP_BACKWARD") and lines.get(instruction.argval) == lines.get(instruction.offset):
+            return False
+    return True
+
+
+def run_with_settrace(code, run, line_callback):
+    # line events are only reported for frames executing the code object "code"
+    # or one of the code objects nested in it
+    codes = get_nested_codes(code)
+
+    def line_tracer(frame, event, arg):
+        if event == "line":
+            line_callback(frame, frame.f_lineno)
+        return line_tracer
+
+    def global_tracer(frame, event, arg):
+        if frame.f_code in codes:
+            return line_tracer
+        return None
+
+    sys.settrace(global_tracer)
+    try:
+        run()
+    finally:
+        sys.settrace(None)
+
+
+def run_with_monitoring(code, run, line_callback):
+    # LINE events are only enabled on the code object "code", every other
+    # frame (builtins, the harness itself ..etc) runs without any tracing overhead
+    monitoring = sys.monitoring
+    tool_id = get_monitoring_tool_id()
+
+    def on_line(event_code, lineno):
+        # the monitored frame is the caller of the callback
+        line_callback(sys._getframe(1), lineno)
+
+    monitoring.register_callback(tool_id, monitoring.events.LINE, on_line)
+    monitoring.set_local_events(tool_id, code, monitoring.events.LINE)
+    try:
+        run()
+    finally:
+        monitoring.set_local_events(tool_id, code, 0)
+        monitoring.register_callback(tool_id, monitoring.events.LINE, None)
+
+
+def run_traced(code, run, line_callback, backend=None):
+    # call run() while reporting every line executed by the code object "code" (and the code objects nested in it)
+    # to line_callback(frame, lineno), lineno being relative to the source of "code"
+    # the callback can end the run early by raising StepsCaptured
+    # the snippets whose line events sys.monitoring would miss are always traced with sys.settrace
+    line_callback = limit_steps(line_callback)
+    try:
+        if resolve_tracing_backend(backend) == "monitoring" and has_monitored_line_events(code):
+            run_with_monitoring(code, run, line_callback)
+        else:
+            run_with_settrace(code, run, line_callback)
+    except StepsCaptured:
+        pass
+
+
+def trace_code(code, env, line_callback, backend=None):
+    # execute a compiled snippet in the environment env while tracing its lines
+    run_traced(code, lambda: exec(code, env), line_callback, backend)
+
+
+def trace_function(func, line_callback, backend=None):
+    # call func() while tracing the lines of its body
+    run_traced(func.__code__, func, line_callback, backend)
+
+
+def refresh_frame_locals(frame):
+    # before python 3.13, frame.f_locals is a dict kept on the frame and refreshed by every access
+    # it lists the variables in the order the accesses first saw them, so a stepped capture that
+    # skips some steps still refreshes it on them to list the variables in the order they were bound in
+    # (python 3.13+ always lists them in co_varnames order)
+    if sys.version_info < (3, 13):
+        frame.f_locals
+
+
+#____________________Tinypy subset________________________#
+
+SUBSET_STATEMENTS = (ast.Assign, ast.AugAssign, ast.Expr, ast.Pass, ast.If, ast.For, ast.While)
+
+
+def is_tinypy_subset(tree):
+    # check that a parsed snippet stays within the statements whose line events are easy to predict :
+    # one statement per line, single line statements/headers, no jumps (break, continue ..etc)
+    # and no nested code objects (lambdas, comprehensions)
+    # snippets outside of it are always executed through the tracer
+    reached_lines = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            return False
+        if isinstance(node, ast.stmt):
+            if not isinstance(node, SUBSET_STATEMENTS) or node.lineno in reached_lines:
+                return False
+            reached_lines.add(node.lineno)
+            if isinstance(node, (ast.If, ast.While)):
+                header = node.test
+            elif isinstance(node, ast.For):
+                header = node.iter
+            else:
+                header = node
+            if header.end_lineno != node.lineno:
+                return False
+    return True
+
+
+#____________________Generator stepping________________________#
+
+def yield_line(stmt):
+    # "yield line_index" statement (0 based) standing for the line event of stmt
+    return ast.Expr(value=ast.Yield(value=ast.Constant(value=stmt.lineno - 1)))
+
+
+def insert_step_yields(body):
+    # given a list of statements, yield the line index right before every statement runs
+    # (the same moment a tracer receives its line event), loop headers also yield
+    # at the end of their body since they are evaluated again after every iteration
+    stepped_body = []
+    for stmt in body:
+        stepped_body.append(yield_line(stmt))
+        if isinstance(stmt, (ast.For, ast.While)):
+            stmt.body = insert_step_yields(stmt.body) + [yield_line(stmt)]
+        elif isinstance(stmt, ast.If):
+            stmt.body = insert_step_yields(stmt.body)
+        if isinstance(stmt, (ast.If, ast.For, ast.While)) and stmt.orelse:
+            stmt.orelse = insert_step_yields(stmt.orelse)
+        stepped_body.append(stmt)
+    return stepped_body
+
+
+@lru_cache(maxsize=compile_cache_size)
+def compile_step_generator(code_snippet):
+    # given a code snippet, return a generator function running the snippet that yields
+    # the line index (0 based) of every step, or None if the snippet is outside the tinypy subset
+    # the variables of the snippet at a given step are read from the suspended generator :
+    # generator.gi_frame.f_locals
+    tree = ast.parse(code_snippet)
+    if not is_tinypy_subset(tree):
+        return None
+    func = ast.parse("def func():\n\tpass").body[0]
+    func.body = insert_step_yields(tree.body)
+    tree.body = [func]
+    ast.fix_missing_locations(tree)
+    env = {"__builtins__": __builtins__}
+    exec(compile(tree, '<string>', 'exec'), env)
+    return env["func"]
+
+
+def track_line_limits(line_indexes):
+    # given the line indexes (0 based) of consecutive steps, yield for every step :
+    # (line_index, lineno_limit, iterated_end), the same values the stepped harnesses compute
+    # from their line events (furthest line reached so far, and whether the step went back to an earlier line)
+    lineno_limit = 0
+    iterated_end = False
+    for line_index in line_indexes:
+        if(lineno_limit > line_index):
+            iterated_end=True
+        elif(lineno_limit < line_index):
+            iterated_end=False
+            lineno_limit = line_index
+        yield line_index, lineno_limit, iterated_end
+
+
+def run_step_generator(step_function):
+    # run a step generator function (see compile_step_generator) and yield for every step :
+    # (frame, line_index, lineno_limit, iterated_end), "frame" being the suspended frame of the snippet
+    steps = step_function()
+    budgeted_step = limit_steps(lambda: None)
+    for line_index, lineno_limit, iterated_end in track_line_limits(steps):
+        budgeted_step()
+        yield steps.gi_frame, line_index, lineno_limit, iterated_end
+
+
+#____________________Step capture________________________#
+
+# execution harness that records every step of the snippet in a single run
+# into the ExecutionTrace object "trace" (the variable states only of its captured steps)
+trace_stack = """
+lineno_limit = 0
+iterated_end = False
+
+def line_tracer(frame, lineno):
+    global lineno_limit
+    global iterated_end
+    line_index = lineno-2
+    if(lineno_limit > line_index):
+        iterated_end=True
+    elif(lineno_limit < line_index):
+        iterated_end=False
+        lineno_limit = line_index
+    # the locals are only formatted at the captured steps
+    if trace.captures(len(trace) + 1):
+        state_fill = ";".join([f"{key}?{value:}" for key, value in frame.f_locals.items()])
+    else:
+        state_fill = None
+        refresh_frame_locals(frame)
+    trace.record(state_fill, line_index, lineno_limit, iterated_end)
+    if trace.is_complete():
+        raise StepsCaptured()
+
+trace_function(func, line_tracer)"""
+
+
+
+class ExecutionTrace():
+    """
+    holds every step reached during a single traced execution of a code snippet
+    step number N (1 based, counting every line event of the execution) is stored in steps[N-1] as :
+        (variable_states, highlighted_line_nb, max_reached_line_nb, keep_last_reached_line)
+    verified_lines holds every line index (1 based) reached during the whole execution
+    capture_steps is the set of step numbers whose variable states are materialized
+    (None captures every step), variable_states is None for the other steps
+    with stop_when_captured, the execution stops right after the last captured step
+    (the trace then ends on that step, and verified_lines only covers the steps before it)
+    """
+    def __init__(self, capture_steps=None, stop_when_captured=False):
+        self.steps = []
+        self.verified_lines = set()
+        self.capture_steps = capture_steps
+        self.stop_when_captured = stop_when_captured and capture_steps is not None
+        self.captured = 0
+
+    def captures(self, step):
+        return self.capture_steps is None or step in self.capture_steps
+
+    def is_complete(self):
+        # whether the execution can stop, every requested step being captured
+        return self.stop_when_captured and self.captured == len(self.capture_steps)
+
+    def record(self, variable_states, highlighted_line_nb, max_reached_line_nb, keep_last_reached_line):
+        self.steps.append((variable_states, highlighted_line_nb, max_reached_line_nb, keep_last_reached_line))
+        self.verified_lines.add(highlighted_line_nb + 1)
+        if variable_states is not None:
+            self.captured += 1
+
+    def __len__(self):
+        return len(self.steps)
+
+    def get_step(self, step):
+        return self.steps[step - 1]
+
+    def get_verified_lines_till_step(self, step):
+        # lines reached before the step (and the line of the step when keep_last_reached_line)
+        _, _, max_reached_line_nb, keep_last_reached_line = self.get_step(step)
+        if keep_last_reached_line:
+            return {x for x in self.verified_lines if x<=max_reached_line_nb+1}
+        else:
+            return {x for x in self.verified_lines if x<max_reached_line_nb+1}
+
+
+STEP_CAPTURE_ENGINES = ("interpreter", "generator", "traced")
+
+
+def get_tinypy_program(code_snippet, engine="interpreter"):
+    # return the interpreted program of a snippet when the step capture engine allows it
+    # None means that the snippet has to go through the step generator or the tracer
+    # (tinypy_interpreter.py imports this module, hence the late import)
+    from tinypy_interpreter import compile_tinypy
+    if engine not in STEP_CAPTURE_ENGINES:
+        raise ValueError(f"unknown step capture engine {engine!r}")
+    if engine != "interpreter":
+        return None
+    return compile_tinypy(code_snippet)
+
+
+def get_step_function(code_snippet, engine="interpreter"):
+    # return the step generator of a snippet when the step capture engine allows it
+    # None means that the snippet has to be traced
+    if engine not in STEP_CAPTURE_ENGINES:
+        raise ValueError(f"unknown step capture engine {engine!r}")
+    if engine == "traced":
+        return None
+    return compile_step_generator(code_snippet)
+
+
+def get_execution_trace(code_snippet, capture_steps=None, stop_when_captured=False, engine="interpreter", backend=None):
+    # given a code snippet, execute it once while recording
+    # every step in an ExecutionTrace object
+    # the variable states are only materialized for the steps in capture_steps (None means every step)
+    # with stop_when_captured, the execution ends as soon as all of them are captured
+    # engine is one of STEP_CAPTURE_ENGINES, backend the tracing backend of the traced snippets
+    trace = ExecutionTrace(capture_steps, stop_when_captured)
+    program = get_tinypy_program(code_snippet, engine)
+    step_function = get_step_function(code_snippet, engine) if program is None else None
+
+    # the snippet's prints are not part of the trace
+    SIO = StringIO()
+    with redirect_stdout(SIO):
+        if program is not None:
+            recorder = program.record_steps(capture_steps, stop_when_captured)
+            for step, (line_index, lineno_limit, iterated_end) in enumerate(track_line_limits(recorder.lines), 1):
+                state_fill = None
+                if step in recorder.states:
+                    state_fill = ";".join([f"{key}?{value:}" for key, value in recorder.states[step]])
+                trace.record(state_fill, line_index, lineno_limit, iterated_end)
+        elif step_function is None:
+            exec_harness(code_snippet, trace_stack, {
+                "__builtins__":__builtins__,
+                "trace": trace,
+                },
+                backend
+            )
+        else:
+            for frame, line_index, lineno_limit, iterated_end in run_step_generator(step_function):
+                state_fill = None
+                if trace.captures(len(trace) + 1):
+                    state_fill = ";".join([f"{key}?{value:}" for key, value in frame.f_locals.items()])
+                else:
+                    refresh_frame_locals(frame)
+                trace.record(state_fill, line_index, lineno_limit, iterated_end)
+                if trace.is_complete():
+                    break
+    return trace
@@ -258,6 +258,7 @@ log("Sequential Evaluation loop")
 hard_match_counter = 0
 soft_match_counter = 0
 failures_counter = 0
+verified_match_counter = 0 # answers giving the states of the example at its highlighted line once executed (see is_stepped_answer_correct() in tinypy_interpreter.py)
 
 hard_match_successes = {"example_input":[], "example_output":[], "all-generated-output":[]} # correct generated output + correct stopping (no hallucination) i.e. fully correct
 soft_match_successes = {"example_input":[], "example_output":[], "all-generated-output":[]} # correct initial generated output BUT uncorrect stopping (hallucination)
@@ -267,6 +268,7 @@ import time
 import pandas as pd
 import os
 from tinypy_code_tracer_tokenizer import TinypyTokenizer
+from tinypy_interpreter import is_stepped_answer_correct
 import re
 
 regex = re.compile(r"(.*?input\?)(.*)", re.DOTALL)
@@ -336,6 +338,9 @@ while batch_idx < len(examples):
 	for prompt, generated_output, example_output, prompt_length in zip(prompts_list, generated_outputs, outputs_list, prompt_lengths):
 		generated_output = " ".join(tpt.decode(generated_output)[prompt_length:])
 		generated_output = generated_output.split(" \n\n")[0]
+		# semantic checking : the predicted input put back in the snippet must reach the highlighted line with the same states
+		if is_stepped_answer_correct(prompt, "".join(generated_output.split('\n')[0].split())):
+			verified_match_counter += 1
 		# if hard match
 		if generated_output == example_output:
 			hard_match_counter += 1
@@ -358,7 +363,7 @@ while batch_idx < len(examples):
 	present = time.time()
 		
 	log(f"|ITERS: {batch_idx+batch_size} / {len(examples)} | COMP: {(batch_idx+batch_size)/len(examples) * 100:.2f}% | RATE: {(batch_size)/(present-past):.2f} ex./s | SPD: {present - past :.4f} s/it.| ERT: {convert_seconds(((len(examples)-(batch_idx+batch_size))/batch_size) * (present-past))} | ET: {convert_seconds(time.time()-start_time)}", p_level = 1)
-	log(f"|hard-accuracy: {hard_match_counter} = {(hard_match_counter/(batch_idx+batch_size))*100:.2f}% | soft-accuracy: {soft_match_counter} = {(soft_match_counter/(batch_idx+batch_size))*100:.2f}% |", p_level = 2)
+	log(f"|hard-accuracy: {hard_match_counter} = {(hard_match_counter/(batch_idx+batch_size))*100:.2f}% | soft-accuracy: {soft_match_counter} = {(soft_match_counter/(batch_idx+batch_size))*100:.2f}% | verified-accuracy: {verified_match_counter} = {(verified_match_counter/(batch_idx+batch_size))*100:.2f}% |", p_level = 2)
 		
 	mode, header = ("w",True) if batch_idx == 0 else ("a", False)
 	
@@ -1,62 +1,43 @@
-import os
 import ast
 import random
 import sys
-from tqdm import tqdm
-from io import StringIO
-from contextlib import redirect_stdout
+from tinypy_code_tracer_engine import get_execution_trace
+from tinypy_generation_driver import get_snippet_rng, TaskRun
+from tinypy_interpreter import run_snippet, get_shared_run
 
 
 
 
 #____________________Hyper Parameters________________________#
+# the hyperparameters the driver reads (source_file_path, workers, output_shards ..etc) are described in tinypy_generation_driver.py (see Task scripts)
 source_file_path = "sample_snippets.txt"
+snippet_index_path = None
 destination_file_path = "stepped_input_prediction.txt"
+log_file_path = "log_file.txt"
+output_shards = 0
+deduplicate_snippets = False
+snippet_dedup_on_disk = False
 step_limit = 10 # how many steps to sample from each code snippet (0 means no limit)
 sampling_limit = 3 # how many individual maskings can we generate from each snippet (0 means no limit)
-
-
-stack = """
-from sys import settrace
-code_lines = code.split("\\n")
-
-counter = 0  
-lineno_limit = 0
-iterated_end = False
-
-def line_tracer(frame, event, arg):
-    global counter
-    global lineno_limit
-    global iterated_end
-    current_step = list(code_lines)
-    # Check runtime value range
-
-    state_fill = ";".join([f"{key}?{value:}" for key, value in frame.f_locals.items()])
-    if event == "line":
-        if(lineno_limit > frame.f_lineno-2):
-            iterated_end=True
-        elif(lineno_limit < frame.f_lineno-2):
-            iterated_end=False
-            lineno_limit = frame.f_lineno-2
-        counter +=1
-        if(counter == step):
-            current_step[frame.f_lineno - 2] = "@" + current_step[frame.f_lineno - 2] + "$" + state_fill
-            trace.append(state_fill)
-            trace.append(frame.f_lineno-2)
-            trace.append(lineno_limit)
-            trace.append(iterated_end)
-    return line_tracer
-
-def global_tracer(frame, event, arg):
-    return line_tracer
-
-settrace(global_tracer)
-try:
-    func()
-finally:
-    settrace(None)"""
-
-
+deduplicate_examples = False # drop the examples of a snippet repeating an earlier example of the same snippet (same highlighted line, variable states and masked variable), e.g. the iterations of a loop going through the same states (opt-in, the default datasets keep every example)
+deduplicate_examples_across_snippets = False
+example_dedup_on_disk = False
+tracing_backend = "auto" # "auto", "monitoring" or "settrace" ("auto" uses sys.monitoring on python 3.12+, sys.settrace otherwise)
+snapshot_sampled_steps_only = True # count the steps in a first run, and only read the variable states of the sampled steps in a second one
+step_capture_engine = "interpreter" # "interpreter" (snippets compiled into closures, see tinypy_interpreter.py), "generator" (snippets rewritten into generators) or "traced", snippets outside the tinypy subset are always traced
+max_snippet_steps = 1000000
+max_snippet_seconds = 10 # the validation run on CPython (with the "generator" and "traced" engines, or for snippets outside the tinypy subset) has no line events and is only stopped by a SIGALRM timer, which only exists on unix in the main thread, elsewhere it can go past it
+workers = 1
+chunk_size = 64
+sandboxed_workers = False
+worker_memory_limit_mb = 2048
+worker_cpu_limit_seconds = 60
+snippets_per_worker = 1000
+seed = 0
+snippet_rng_key = "index"
+sweep_configurations = [] # one dataset per configuration, e.g. [{"step_limit": 5, "destination_file_path": "stepped_input_5_steps.txt"}, {"step_limit": 20, "destination_file_path": "stepped_input_20_steps.txt"}]
+trace_store_path = None
+rejection_index_path = None
 
 
 def collect_candidates(tree):
@@ -145,74 +126,18 @@ def mask_all_values_ast(code):
     return results
 
 
-def sample_unique(line_num, count, n):
+def sample_unique(line_num, count, n, rng=random):
     # Build the interval [line_num+1, count] inclusive
     interval = range(line_num + 1, count + 1)
     if n!=0:
         # Clamp n to the size of the interval
         n = min(n, len(interval))
 
-        return random.sample(interval, n)
+        return rng.sample(interval, n)
     else:
         return interval
     
 
-def line_counter(code_snippet):
-        """
-        this function counts how many lines of code in total have been executed 
-        the function follows the following rules :
-            - a line is not counted if :
-                - it falls in a condition bloc where the condition is not verified
-                - it falls in a loop where the number of iterations is equal to zero
-            - a line is counted as much as it has been iterated through "if it sits in a for loop bloc for example "
-        """
-        counter = 0
-
-        def trace_lines(frame, event, arg):
-            nonlocal counter # declaring the outer variable
-            if event == 'line': # every time the tracer detects the execution of a line of code
-                filename = frame.f_code.co_filename
-                if filename == '<string>' : # counting only the lines that are in the code snippet we provided "and not in some other internal libraries"
-                    counter += 1 # increment the global counter
-            return trace_lines
-
-
-        # Set the trace function
-        sys.settrace(trace_lines)
-
-        # Capture the output of the program.
-        SIO = StringIO()
-        with redirect_stdout(SIO):
-            # executing the code, the execution is being traced by the trace_lines() function that has been set previously
-            exec(code_snippet,{'__file__': '<string>'}) # Execute the code and setting the "fake file" name to <string> so that we can recognise this code snippet later in trace_lines()
-
-        # Disable the trace function
-        sys.settrace(None)
-
-        return counter
-
-
-def get_variable_values_from_code_step(code_snippet,step,stack):
-    trace = []
-    indented = "\n".join([f"	{line}" for line in code_snippet.split("\n")])
-    func = "def func():\n" + indented 
-    exec_env = func + stack
-
-    try:
-        exec(exec_env, {
-            "__builtins__": __builtins__,
-            "code": code_snippet,
-            "trace": trace,
-            "step": step,
-        })
-    except Exception as e:
-        return ''
-
-    if len(trace) != 0:
-        return trace[0],trace[1]
-    else:
-        return '',0
-    
 def mask_variable_value(variable_states, var_name):
     """
     Given a state string like 'a?2;b?5;c?9' and a variable name,
@@ -232,25 +157,43 @@ def mask_variable_value(variable_states, var_name):
     
     return ";".join(masked_parts)
 
-def generate_stepped_input_prediction_snippet(code_snippet,step_limit=10,sampling_limit=0):
+def generate_stepped_input_prediction_snippet(code_snippet,step_limit=10,sampling_limit=0,rng=random):
 
     
     
     code_snippet = code_snippet.strip('\n')
-    count = line_counter(code_snippet)
-    masked_list = mask_all_values_ast(code_snippet)
+    # the step states of the original snippet are recorded once and shared by every masking
+    # when snapshot_sampled_steps_only is set, a first run records the steps without their variable states
+    # and a second one only materializes the states of the steps sampled for any of the maskings
+    # that first trace does not depend on the sampling, the configurations of a sweep share it (see shared_runs())
+    trace = get_shared_run(("stepped_input_trace", snapshot_sampled_steps_only), code_snippet, lambda: get_execution_trace(code_snippet, set() if snapshot_sampled_steps_only else None, engine=step_capture_engine, backend=tracing_backend), persist=False)
+    count = len(trace)
+    masked_list = get_shared_run("stepped_input_maskings", code_snippet, lambda: mask_all_values_ast(code_snippet))
     if sampling_limit != 0 and sampling_limit<len(masked_list):
-        masked_list = random.sample(masked_list)
-    results = []
+        masked_list = rng.sample(masked_list, sampling_limit)
+    sampled_steps = []
     for masked_code, original_value, line_num, target_var in masked_list:
         if line_num == count:
             continue
-        possible_steps = sample_unique(line_num,count, step_limit)
+        sampled_steps.append((masked_code, original_value, target_var, sample_unique(line_num,count, step_limit, rng)))
+    if snapshot_sampled_steps_only:
+        # the second run stops right after the last sampled step
+        trace = get_execution_trace(code_snippet, {step for *_, possible_steps in sampled_steps for step in possible_steps}, stop_when_captured=True, engine=step_capture_engine, backend=tracing_backend)
+    results = []
+    # (highlighted line, masked variable states, masking) of the examples generated so far (see deduplicate_examples)
+    generated = set()
+    for masked_code, original_value, target_var, possible_steps in sampled_steps:
         for step in possible_steps:
-            variable_states, highlighted_line_nb = get_variable_values_from_code_step(code_snippet,step,stack)
+            variable_states, highlighted_line_nb, _, _ = trace.get_step(step)
             if variable_states:
+                masked_states = mask_variable_value(variable_states,target_var)
+                if deduplicate_examples:
+                    # the states are compared once masked, the steps only differing by the masked value giving the same example
+                    if (highlighted_line_nb, masked_states, masked_code, original_value) in generated:
+                        continue
+                    generated.add((highlighted_line_nb, masked_states, masked_code, original_value))
                 masked_code_lines = masked_code.split('\n')
-                masked_code_lines[highlighted_line_nb] ="@" + masked_code_lines[highlighted_line_nb] + "$" + mask_variable_value(variable_states,target_var)
+                masked_code_lines[highlighted_line_nb] ="@" + masked_code_lines[highlighted_line_nb] + "$" + masked_states
                 masked_code_final = '\n'.join(masked_code_lines)
                 masked_code_final = masked_code_final+ "\n# input?" + str(original_value)
                 results.append(masked_code_final)
@@ -259,39 +202,25 @@ def generate_stepped_input_prediction_snippet(code_snippet,step_limit=10,samplin
 
 
 
+def validate_snippet(snippet):
+    # run the snippet once, raising the error of a snippet that fails to run, the run is shared with the generation (see shared_runs())
+    run_snippet(snippet, "interpreter" if step_capture_engine == "interpreter" else "cpython")
+
+
+def generate_examples(index, snippet):
+    # the training examples of the snippet at position index of the source file (see TaskRun in tinypy_generation_driver.py)
+    # the random choices of the snippet are drawn from its own generator (see seed/snippet_rng_key)
+    return generate_stepped_input_prediction_snippet(snippet,step_limit,sampling_limit,get_snippet_rng(seed, index, snippet, snippet_rng_key))
+
+
+def get_rejection_scope(index):
+    # the hyperparameters the rejections of the task depend on (see RejectionIndex), along with the position
+    # of the snippet when its random choices depend on it
+    return repr(("stepped_input_prediction", step_limit, sampling_limit, seed, max_snippet_steps, max_snippet_seconds, index if snippet_rng_key == "index" else None))
+
+
 #__________________MAIN_________________________
 
 
 if __name__ =="__main__":
-
-    print("--- Splitting original file content ---\n")
-    with open(source_file_path, 'r', encoding='utf-8') as f:
-        # read the file
-        content = f.read()
-        
-        # extract the code snippets in the form of a list
-        snippet_list = content.split('\n\n')
-
-        # --- Output Results ---
-        print(f"Successfully split the file into {len(snippet_list)} snippets.")
-
-    transformed_snippets = []
-    log = []
-    index = -1
-    for snippet in tqdm(snippet_list, desc="Processing Snippets"):
-        index += 1
-        try:
-            exec(snippet, {})
-            snippets = generate_stepped_input_prediction_snippet(snippet,step_limit,sampling_limit)
-            log.append(str(index)+' '+str(len(snippets)))
-            transformed_snippets.extend(snippets)
-        except Exception:
-            log.append(str(index)+' 0')
-            continue  # skip invalid snippet
-    print("generated :",len(transformed_snippets)," snippets")
-    print("Writing...")
-    with open(destination_file_path, "w", encoding="utf-8") as f:
-        f.write("\n\n".join(transformed_snippets))
-    with open("log_file.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(log))
-    print("Done, sucessfully written to :"+destination_file_path)
\ No newline at end of file
+    TaskRun().run(sys.argv[1:])
@@ -1,23 +1,47 @@
-import os
 import ast
 import random
 import sys
-from tqdm import tqdm
-from io import StringIO
-from contextlib import redirect_stdout
+from tinypy_code_tracer_engine import exec_harness, run_step_generator, refresh_frame_locals, get_tinypy_program, get_step_function, get_execution_trace
+from tinypy_generation_driver import get_snippet_rng, TaskRun
+from tinypy_interpreter import run_snippet, get_shared_run
 
 
 
 
 #____________________Hyper Parameters________________________#
+# the hyperparameters the driver reads (source_file_path, workers, output_shards ..etc) are described in tinypy_generation_driver.py (see Task scripts)
 source_file_path = "sample_snippets.txt"
+snippet_index_path = None
 destination_file_path = "stepped_operator_prediction.txt"
+log_file_path = "log_file.txt"
+output_shards = 0
+deduplicate_snippets = False
+snippet_dedup_on_disk = False
 include_arithmetic_masking = True
 include_comparator_masking = False
 errored_snippets_are_non_deterministic = True
 different_step_answers_are_non_deterministic = True
 limit = 0 # How many operator masking cases to generate out of a single snippet step (0 means no limit)
 sampling_limit = 3 # how many random selected steps to generate out of each snippet (0 means no limit)
+deduplicate_examples = False # drop the examples of a snippet repeating an earlier example of the same snippet (same highlighted line, variable states and masked operator), e.g. the iterations of a loop going through the same states (opt-in, the default datasets keep every example)
+deduplicate_examples_across_snippets = False
+example_dedup_on_disk = False
+tracing_backend = "auto" # "auto", "monitoring" or "settrace" ("auto" uses sys.monitoring on python 3.12+, sys.settrace otherwise)
+snapshot_sampled_steps_only = True # count the steps in a first run, and only read the variable states of the sampled steps in a second one
+step_capture_engine = "interpreter" # "interpreter" (snippets compiled into closures, see tinypy_interpreter.py), "generator" (snippets rewritten into generators) or "traced", snippets outside the tinypy subset are always traced
+max_snippet_steps = 1000000
+max_snippet_seconds = 10 # the validation run on CPython (with the "generator" and "traced" engines, or for snippets outside the tinypy subset) has no line events and is only stopped by a SIGALRM timer, which only exists on unix in the main thread, elsewhere it can go past it
+workers = 1
+chunk_size = 64
+sandboxed_workers = False
+worker_memory_limit_mb = 2048
+worker_cpu_limit_seconds = 60
+snippets_per_worker = 1000
+seed = 0
+snippet_rng_key = "index"
+sweep_configurations = [] # one dataset per configuration, e.g. [{"sampling_limit": 3, "destination_file_path": "stepped_operator_3_steps.txt"}, {"sampling_limit": 10, "include_comparator_masking": True, "destination_file_path": "stepped_operator_10_steps.txt"}]
+trace_store_path = None
+rejection_index_path = None
 # OPPOSITE_OPERATORS = { 
 #     '<': ['>'],
 #     '>': ['<'],
@@ -33,70 +57,38 @@ OPPOSITE_OPERATORS = {
     '+': ['-'],
     '-': ['+']
 }
-#____________________Utility Functions________________________#
-
-def get_variable_values_from_code(code_snippet):
-
-
-    # --- Step 1: Static Analysis with AST ---
-    # We use ast.walk to find all variable assignments and record their
-    # names in the order they first appear.
-    
-    ordered_variables = []
-    try:
-        tree = ast.parse(code_snippet)
-
-        # adding nodes that include variable names, or assignments ..etc
-        nodes = [node for node in ast.walk(tree)
-                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)]
-
-        # Sort by line number, then column offset
-        nodes.sort(key=lambda n: (n.lineno, n.col_offset))
-
-        ordered_variables = []
-        for node in nodes:
-            if node.id not in ordered_variables:
-                ordered_variables.append(node.id)
-
-    except SyntaxError as e:
-        print(f"Error parsing code: {e}")
-        return None
-
-    # --- Step 2: Dynamic Execution ---
-    # We execute the code in a controlled environment to capture the final
-    # state of the variables.
-    
-    # This dictionary will act as the local scope for the executed code.
-    local_scope = {}
-    try:
-        # The exec() function runs the Python code. The second argument
-        # is the global scope (we leave it empty) and the third is the
-        # local scope, which will be populated by the code.
-        exec(code_snippet, {}, local_scope)
-    except Exception as e:
-        return None
 
- 
-    if not ordered_variables:
-        print("No variable assignments found.")
-        return None
-
-
-    variable_dictionary = []
-
-    for var_name in ordered_variables:
-        if var_name in local_scope:
-            # Retrieve the final value from the scope dictionary.
-            last_value = local_scope[var_name]
-            variable_dictionary.append((var_name,last_value))
-
-        #else:
-            # This case is rare but could happen if a variable is declared
-            # in a scope that doesn't persist, e.g., a list comprehension.
-            #variable_dictionary.append((var_name,None))
+# execution harness that freezes the snippet at a single step "step"
+# (used to verify the determinism of a masked operator)
+stack = """
+counter = 0
+lineno_limit = 0
+iterated_end = False
 
+def line_tracer(frame, lineno):
+    global counter
+    global lineno_limit
+    global iterated_end
+    if(lineno_limit > lineno-2):
+        iterated_end=True
+    elif(lineno_limit < lineno-2):
+        iterated_end=False
+        lineno_limit = lineno-2
+    counter +=1
+    # the locals are only formatted at the requested step, every other step just moves the counter
+    if(counter == step):
+        state_fill = ";".join([f"{key}?{value:}" for key, value in frame.f_locals.items()])
+        trace.append(state_fill)
+        trace.append(lineno-2)
+        trace.append(lineno_limit)
+        trace.append(iterated_end)
+        # the requested step is captured, the rest of the execution is skipped
+        raise StepsCaptured()
+    else:
+        refresh_frame_locals(frame)
 
-    return variable_dictionary
+trace_function(func, line_tracer)"""
+#____________________Utility Functions________________________#
 
 def find_operator_location(code_line, left_end_col, right_start_col):
     # given a code line, and the delimiters of an expression in that code line
@@ -108,37 +100,6 @@ def find_operator_location(code_line, left_end_col, right_start_col):
     return -1
 
 
-def get_verified_lines(code):
-    # given a code snippet, return a list of all line indexes
-    # that have been reached during the execution of the snippet
-    # lines that are not reached include lines within if-blocks 
-    # that have a 'false' condition
-
-    # using a set() to avoid redunduncy
-    verified_lines = set()
-
-    def trace_lines(frame, event, arg):
-        if event == "line":
-            lineno = frame.f_lineno
-            verified_lines.add(lineno)
-        return trace_lines
-
-    sys.settrace(trace_lines)
-    try:
-        exec(code, {})
-    finally:
-        sys.settrace(None)
-
-    return verified_lines
-
-def get_verified_lines_till_step(code,max_reached_line_nb,keep_last_reached_line):
-    ## MAX_REACHED_LINE_NB MUST BE 1 BASED (first line is 1)
-    verified = get_verified_lines(code)
-    if keep_last_reached_line: 
-        return {x for x in verified if x<=max_reached_line_nb}
-    else:
-        return {x for x in verified if x<max_reached_line_nb}
-
 def find_operators_to_replace(code_snippet,verified_lines):
     # given a code snippet, the code returns a list of
     # all operators (arithmetic/comparative) that can
@@ -194,17 +155,32 @@ def find_operators_to_replace(code_snippet,verified_lines):
 
 def get_variable_values_from_code_step(code_snippet,step,stack):
     trace = []
-    indented = "\n".join([f"	{line}" for line in code_snippet.split("\n")])
-    func = "def func():\n" + indented 
-    exec_env = func + stack
 
     try:
-        exec(exec_env, {
-            "__builtins__": __builtins__,
-            "code": code_snippet,
-            "trace": trace,
-            "step": step,
-        })
+        program = get_tinypy_program(code_snippet, step_capture_engine)
+        step_function = get_step_function(code_snippet, step_capture_engine) if program is None else None
+        if program is not None:
+            recorder = program.record_steps({step}, stop_when_captured=True)
+            if step in recorder.states:
+                trace.append(";".join([f"{key}?{value:}" for key, value in recorder.states[step]]))
+                trace.append(recorder.lines[step - 1])
+        elif step_function is None:
+            exec_harness(code_snippet, stack, {
+                "__builtins__": __builtins__,
+                "code": code_snippet,
+                "trace": trace,
+                "step": step,
+            }, tracing_backend)
+        else:
+            counter = 0
+            for frame, line_index, _, _ in run_step_generator(step_function):
+                counter +=1
+                if(counter == step):
+                    trace.append(";".join([f"{key}?{value:}" for key, value in frame.f_locals.items()]))
+                    trace.append(line_index)
+                    break
+                else:
+                    refresh_frame_locals(frame)
     except Exception as e:
         return '', -1
 
@@ -248,120 +224,40 @@ def replace_operator_with_symbol(code_snippet, op_col, op_line,symbol):
     return "\n".join(code_lines)
 
 
-def line_counter(code_snippet):
-        """
-        this function counts how many lines of code in total have been executed 
-        the function follows the following rules :
-            - a line is not counted if :
-                - it falls in a condition bloc where the condition is not verified
-                - it falls in a loop where the number of iterations is equal to zero
-            - a line is counted as much as it has been iterated through "if it sits in a for loop bloc for example "
-        """
-        counter = 0
-
-        def trace_lines(frame, event, arg):
-            nonlocal counter # declaring the outer variable
-            if event == 'line': # every time the tracer detects the execution of a line of code
-                filename = frame.f_code.co_filename
-                if filename == '<string>' : # counting only the lines that are in the code snippet we provided "and not in some other internal libraries"
-                    counter += 1 # increment the global counter
-            return trace_lines
-
-
-        # Set the trace function
-        sys.settrace(trace_lines)
-
-        # Capture the output of the program.
-        SIO = StringIO()
-        with redirect_stdout(SIO):
-            # executing the code, the execution is being traced by the trace_lines() function that has been set previously
-            exec(code_snippet,{'__file__': '<string>'}) # Execute the code and setting the "fake file" name to <string> so that we can recognise this code snippet later in trace_lines()
-
-        # Disable the trace function
-        sys.settrace(None)
-
-        return counter
-
-
-def generate_stepped_operator_prediction_snippet(code_snippet, operator_dictionary,limit=0,sampling_limit=0):
+def generate_stepped_operator_prediction_snippet(code_snippet, operator_dictionary,limit=0,sampling_limit=0,rng=random):
     # given a code snippet, return all possible training instances
     # for the stepped operator prediction task, in a list
     code_snippet = code_snippet.strip('\n')
-    # Prepare the execution environment by putting the code snippet inside a function and setting up a Python trace function
-    indented = "\n".join([f"	{line}" for line in code_snippet.split("\n")])
-    func = "def func():\n" + indented 
-
-    stack = """
-from sys import settrace
-code_lines = code.split("\\n")
-
-counter = 0  
-lineno_limit = 0
-iterated_end = False
-
-def line_tracer(frame, event, arg):
-    global counter
-    global lineno_limit
-    global iterated_end
-    current_step = list(code_lines)
-
-    state_fill = ";".join([f"{key}?{value:}" for key, value in frame.f_locals.items()])
-    if event == "line":
-        if(lineno_limit > frame.f_lineno-2):
-            iterated_end=True
-        elif(lineno_limit < frame.f_lineno-2):
-            iterated_end=False
-            lineno_limit = frame.f_lineno-2
-        counter +=1
-        if(counter == step):
-            current_step[frame.f_lineno - 2] = "@" + current_step[frame.f_lineno - 2] + "$" + state_fill
-            trace.append(state_fill)
-            trace.append(frame.f_lineno-2)
-            trace.append(lineno_limit)
-            trace.append(iterated_end)
-    return line_tracer
-
-def global_tracer(frame, event, arg):
-    return line_tracer
-
-settrace(global_tracer)
-try:
-    func()
-finally:
-    settrace(None)"""
-
-
-    exec_env = func + stack
-    trace_limit = line_counter(code_snippet)
+    # every sampled step is read from a recorded trace instead of re-executing the snippet
+    # when only a few steps are sampled, a first run records the steps without their variable states
+    # and a second one only materializes the states of the sampled steps
+    # that first trace does not depend on the sampling, the configurations of a sweep share it (see shared_runs())
+    trace = get_shared_run(("stepped_operator_trace", snapshot_sampled_steps_only), code_snippet, lambda: get_execution_trace(code_snippet, set() if snapshot_sampled_steps_only else None, engine=step_capture_engine, backend=tracing_backend), persist=False)
+    trace_limit = len(trace)
     possible_lines = list(range(1,trace_limit+1))
     if sampling_limit >0 and sampling_limit < trace_limit:
-        possible_lines = random.sample(possible_lines,sampling_limit)
+        possible_lines = rng.sample(possible_lines,sampling_limit)
+    if snapshot_sampled_steps_only:
+        # the second run stops right after the last sampled step
+        # the lines verified by the whole execution are kept from the first run
+        sampled_trace = get_execution_trace(code_snippet, set(possible_lines), stop_when_captured=True, engine=step_capture_engine, backend=tracing_backend)
+        sampled_trace.verified_lines = trace.verified_lines
+        trace = sampled_trace
     total_snippets = []
-    for sample_line in possible_lines: 
-        trace = []
-
-        exec(exec_env, {
-            "__builtins__":__builtins__, 
-            "code": code_snippet,
-            "trace": trace,
-            "step": sample_line,
-            }
-        )
+    # (highlighted line, variable states, masked operator) of the examples generated so far (see deduplicate_examples)
+    generated = set()
+    for sample_line in possible_lines:
 
-        variable_states = trace[0]
-        highlighted_line_nb = trace[1]
-        max_reached_line_nb = trace[2]
-        keep_last_reached_line = trace[3]
+        variable_states, highlighted_line_nb, _, _ = trace.get_step(sample_line)
 
-
-        verified_lines = get_verified_lines_till_step(code_snippet ,max_reached_line_nb+1,keep_last_reached_line)
+        verified_lines = trace.get_verified_lines_till_step(sample_line)
 
         candidates = find_operators_to_replace(code_snippet,verified_lines)
 
         if limit == 0 or limit>=len(candidates):
             selected = candidates
         else:
-            selected = random.sample(candidates, limit)
+            selected = rng.sample(candidates, limit)
 
         code_snippets = []
 
@@ -369,6 +265,10 @@ finally:
         if variable_states:
             for candidate in selected:
                 op, col, line = candidate
+                if deduplicate_examples:
+                    if (highlighted_line_nb, variable_states, col, line) in generated:
+                        continue
+                    generated.add((highlighted_line_nb, variable_states, col, line))
                 #if (is_deterministic(code_snippet,col,line,operator_dictionary.get(op),variable_states,highlighted_line_nb,sample_line,stack)):
                 modified_code = replace_operator_with_symbol(code_snippet,col,line,'?')
                 modified_code_lines = modified_code.split('\n')
@@ -387,39 +287,25 @@ finally:
 
 
 
+def validate_snippet(snippet):
+    # run the snippet once, raising the error of a snippet that fails to run, the run is shared with the generation (see shared_runs())
+    run_snippet(snippet, "interpreter" if step_capture_engine == "interpreter" else "cpython")
+
+
+def generate_examples(index, snippet):
+    # the training examples of the snippet at position index of the source file (see TaskRun in tinypy_generation_driver.py)
+    # the random choices of the snippet are drawn from its own generator (see seed/snippet_rng_key)
+    return generate_stepped_operator_prediction_snippet(snippet,OPPOSITE_OPERATORS,limit=limit,sampling_limit=sampling_limit,rng=get_snippet_rng(seed, index, snippet, snippet_rng_key))
+
+
+def get_rejection_scope(index):
+    # the hyperparameters the rejections of the task depend on (see RejectionIndex), along with the position
+    # of the snippet when its random choices depend on it
+    return repr(("stepped_operator_prediction", include_arithmetic_masking, include_comparator_masking, limit, sampling_limit, OPPOSITE_OPERATORS, seed, max_snippet_steps, max_snippet_seconds, index if snippet_rng_key == "index" else None))
+
+
 #__________________MAIN_________________________
 
 
 if __name__ =="__main__":
-
-    print("--- Splitting original file content ---\n")
-    with open(source_file_path, 'r', encoding='utf-8') as f:
-        # read the file
-        content = f.read()
-        
-        # extract the code snippets in the form of a list
-        snippet_list = content.split('\n\n')
-
-        # --- Output Results ---
-        print(f"Successfully split the file into {len(snippet_list)} snippets.")
-
-    transformed_snippets = []
-    log = []
-    index = -1
-    for snippet in tqdm(snippet_list, desc="Processing Snippets"):
-        index += 1
-        try:
-            exec(snippet, {})
-            snippets = generate_stepped_operator_prediction_snippet(snippet,OPPOSITE_OPERATORS,limit=limit,sampling_limit=sampling_limit)
-            log.append(str(index)+' '+str(len(snippets)))
-            transformed_snippets.extend(snippets)
-        except Exception:
-            log.append(str(index)+' 0')
-            continue  # skip invalid snippet
-    print("generated :",len(transformed_snippets)," snippets")
-    print("Writing...")
-    with open(destination_file_path, "w", encoding="utf-8") as f:
-        f.write("\n\n".join(transformed_snippets))
-    with open("log_file.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(log))
-    print("Done, sucessfully written to :"+destination_file_path)
\ No newline at end of file
+    TaskRun().run(sys.argv[1:])
@@ -0,0 +1,1375 @@
+import io
+import os
+import re
+import sys
+import bz2
+import copy
+import gzip
+import json
+import lzma
+import mmap
+import struct
+import random
+import tokenize
+import sqlite3
+import hashlib
+import importlib
+import multiprocessing
+from contextlib import contextmanager, ExitStack
+from collections import deque, Counter
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from multiprocessing.connection import wait
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from tinypy_code_tracer_engine import snippet_budget, BudgetExceeded
+from tinypy_interpreter import shared_runs
+try:
+    import resource
+except ImportError:
+    # not available on windows, sandboxed workers then run without resource limits
+    resource = None
+
+
+
+#____________________Hyper Parameters________________________#
+default_chunk_size = 64 # how many snippets are sent to a worker at once
+rejection_batch_size = 256 # how many rejections a process keeps before writing them to the rejection index at once
+SNIPPET_RNG_KEYS = ("index", "content")
+#____________________Driver________________________#
+
+def get_snippet_rng(seed, index, snippet, key="index"):
+    # return the random generator a snippet samples its examples with, derived from the run seed and
+    # either the index of the snippet in the source file ("index") or its text ("content")
+    # it does not depend on what was processed before, so serial, multi-process and multi-node runs
+    # sample the same examples ("content" also keeps them when snippets are reordered or filtered out)
+    if key not in SNIPPET_RNG_KEYS:
+        raise ValueError(f"unknown snippet rng key {key!r}, expected one of {SNIPPET_RNG_KEYS}")
+    material = index if key == "index" else snippet
+    digest = hashlib.sha256(f"{seed}:{key}:{material}".encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def get_worker_count(workers):
+    # 0 (or None) means one worker per cpu
+    if not workers:
+        return os.cpu_count() or 1
+    return workers
+
+
+def get_total(snippets):
+    # number of snippets when it is known in advance (lists), None for lazily read snippets
+    return len(snippets) if hasattr(snippets, "__len__") else None
+
+
+def process_chunk(process_snippet, chunk, corpus_paths=None):
+    # worker side of process_in_order() : process a chunk of (index, snippet) tasks, or with the paths of
+    # a SnippetCorpus, the snippets of the indexes of the chunk (a range), read by the worker from its own map of the file
+    if corpus_paths is not None:
+        corpus = get_snippet_corpus(*corpus_paths)
+        results = [process_snippet(index, corpus[index]) for index in chunk]
+    else:
+        results = [process_snippet(index, snippet) for index, snippet in chunk]
+    flush_rejection_indexes()
+    return results
+
+
+def get_tasks(snippets):
+    # the (index, snippet) tasks of the snippets, the snippets of a SnippetCorpus being left to the workers to read (None)
+    if isinstance(snippets, SnippetCorpus):
+        return ((index, None) for index in range(snippets.start, snippets.stop))
+    return enumerate(snippets)
+
+
+def get_chunks(tasks, chunk_size, corpus_paths=None):
+    # yield the chunks process_chunk() receives : lists of (index, snippet) tasks, or for a SnippetCorpus
+    # their indexes (a range unless some snippets were left out, see SnippetDeduplicator)
+    while True:
+        chunk = list(islice(tasks, chunk_size))
+        if not chunk:
+            break
+        if corpus_paths is None:
+            yield chunk
+            continue
+        indexes = [index for index, _ in chunk]
+        yield range(indexes[0], indexes[-1] + 1) if indexes[-1] - indexes[0] + 1 == len(indexes) else indexes
+
+
+def process_in_order(process_snippet, snippets, workers=1, chunk_size=default_chunk_size, desc="Processing Snippets", sandbox=None, crashed_result=None, deduplicator=None, duplicate_result=None):
+    # apply process_snippet(index, snippet) to every snippet of snippets (a list, or an iterable such as read_snippets())
+    # and yield the results in the order of the snippets, whatever the number of workers
+    # with a single worker the snippets are processed in this process, otherwise they are sent
+    # in chunks of chunk_size to a pool of worker processes
+    # with a sandbox (SandboxLimits), they are sent one by one to sandboxed worker processes instead,
+    # and a snippet whose worker crashed gets crashed_result(index, snippet) as its result
+    # with a deduplicator (SnippetDeduplicator), the snippets it saw before are not processed at all,
+    # they get duplicate_result(index, snippet) as their result (the deduplicator is closed afterwards),
+    # the duplicates of a SnippetCorpus being read from its dedup index instead (see build_snippet_dedup_index())
+    # the snippets are read from the iterable as the workers need them, and only a few chunks
+    # are in flight at once, so memory does not grow with the number of snippets
+    # the snippets of a SnippetCorpus are not sent at all : the workers only receive snippet ranges (or indexes)
+    # and read the snippets from their own memory map of the file, the indexes of a selection of a corpus
+    # (see SnippetCorpus.select()) are the ones of its snippets in the whole file
+    # process_snippet must be a module level function (it is sent to the workers by name)
+    workers = get_worker_count(workers)
+    corpus = snippets if isinstance(snippets, SnippetCorpus) else None
+    tasks = get_tasks(snippets)
+    with tqdm(total=get_total(snippets), desc=desc) as progress:
+        if deduplicator is None:
+            yield from process_tasks(process_snippet, tasks, corpus, workers, chunk_size, progress, sandbox, crashed_result)
+            return
+        try:
+            yield from process_unique_tasks(process_snippet, tasks, corpus, workers, chunk_size, progress, sandbox, crashed_result, deduplicator, duplicate_result)
+        finally:
+            deduplicator.close()
+
+
+def process_tasks(process_snippet, tasks, corpus, workers, chunk_size, progress, sandbox=None, crashed_result=None):
+    # process the (index, snippet) tasks (see process_in_order()), yielding their results in order
+    if sandbox is not None:
+        yield from process_sandboxed(process_snippet, tasks, corpus, workers, sandbox, crashed_result, progress)
+        return
+    if workers == 1:
+        try:
+            for index, snippet in tasks:
+                result = process_snippet(index, corpus[index] if snippet is None else snippet)
+                progress.update(1)
+                yield result
+        finally:
+            flush_rejection_indexes()
+        return
+
+    corpus_paths = corpus.paths() if corpus is not None else None
+    chunks = get_chunks(tasks, chunk_size, corpus_paths)
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # keep two chunks per worker in flight, one being processed and one waiting
+            while len(in_flight) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.append(pool.submit(process_chunk, process_snippet, chunk, corpus_paths))
+            if not in_flight:
+                break
+            results = in_flight.popleft().result()
+            progress.update(len(results))
+            yield from results
+
+
+def process_unique_tasks(process_snippet, tasks, corpus, workers, chunk_size, progress, sandbox, crashed_result, deduplicator, duplicate_result):
+    # process the tasks whose snippet the deduplicator did not see before, and give the others duplicate_result(index, snippet),
+    # yielding the results of all of them in order
+    # the snippets of a SnippetCorpus are checked through its dedup index (see build_snippet_dedup_index()), built once for the
+    # whole file, so that every shard drops the same snippets a single run does without going through the snippets before it
+    first_occurrences = get_first_occurrences(corpus, deduplicator.on_disk) if corpus is not None else None
+    order = deque() # the (index, snippet) of the duplicates read so far, in the order of the snippets, None standing for a processed snippet
+
+    def unique_tasks():
+        for index, snippet in tasks:
+            if first_occurrences is not None:
+                duplicate = first_occurrences[index - corpus.start] != index
+            else:
+                duplicate = deduplicator.seen(snippet)
+            if duplicate:
+                order.append((index, corpus[index] if snippet is None else snippet))
+            else:
+                order.append(None)
+                yield index, snippet
+
+    for result in process_tasks(process_snippet, unique_tasks(), corpus, workers, chunk_size, progress, sandbox, crashed_result):
+        while order[0] is not None:
+            progress.update(1)
+            yield duplicate_result(*order.popleft())
+        order.popleft()
+        yield result
+    for duplicate in order:
+        progress.update(1)
+        yield duplicate_result(*duplicate)
+
+
+@contextmanager
+def hyperparameters(namespace, overrides):
+    # temporarily override the hyperparameters of a task script (module level variables, namespace being its globals())
+    # with the {name: value} pairs of overrides, e.g. a configuration of a sweep
+    unknown = [name for name in overrides if name not in namespace]
+    if unknown:
+        raise ValueError(f"unknown hyperparameters {unknown}")
+    previous = {name: namespace[name] for name in overrides}
+    namespace.update(overrides)
+    try:
+        yield
+    finally:
+        namespace.update(previous)
+
+
+#____________________Streaming I/O________________________#
+
+COMPRESSED_EXTENSIONS = (".gz", ".xz", ".bz2")
+
+
+def get_compression(path):
+    # compression of a file given by its extension (".gz", ".xz" or ".bz2"), None for a plain file
+    extension = os.path.splitext(path)[1].lower()
+    return extension if extension in COMPRESSED_EXTENSIONS else None
+
+
+def split_extension(path):
+    # (stem, extension) of a path, the extension of a compressed file including the one before it, e.g. ("data", ".txt.gz")
+    stem, extension = os.path.splitext(path)
+    if get_compression(path) is not None:
+        stem, inner_extension = os.path.splitext(stem)
+        extension = inner_extension + extension
+    return stem, extension
+
+
+def open_file(path, mode="r", buffering=-1, fileobj=None):
+    # open a file like open(path, mode) does (text mode being utf-8), a ".gz", ".xz" or ".bz2" file being
+    # (de)compressed on the fly as it is read or written, so compressed datasets are streamed without a separate step
+    # gzip files are written without timestamp, the same examples always giving the same file
+    # with a binary fileobj (left open), it is read or written instead of path, which only gives the compression
+    # (and the name a gzip file records), so a temporary file holds the very bytes path would
+    compression = get_compression(path)
+    if compression is None:
+        if fileobj is not None:
+            return fileobj if "b" in mode else io.TextIOWrapper(fileobj, encoding="utf-8")
+        return open(path, mode, buffering=buffering, encoding=None if "b" in mode else "utf-8")
+    binary_mode = mode.replace("t", "").replace("b", "") + "b"
+    if compression == ".gz":
+        f = gzip.GzipFile(path, binary_mode, compresslevel=6, fileobj=fileobj, mtime=0)
+    elif compression == ".xz":
+        f = lzma.LZMAFile(path if fileobj is None else fileobj, binary_mode)
+    else:
+        f = bz2.BZ2File(path if fileobj is None else fileobj, binary_mode)
+    return f if "b" in mode else io.TextIOWrapper(f, encoding="utf-8")
+
+
+def read_snippets(path, separator="\n\n", read_size=1 << 20):
+    # yield the snippets of a source file one by one, the same ones open(path).read().split(separator) gives,
+    # reading the file read_size characters at a time instead of all at once (see open_file() for compressed files)
+    with open_file(path, 'r') as f:
+        pending = ""
+        while True:
+            block = f.read(read_size)
+            if not block:
+                break
+            parts = (pending + block).split(separator)
+            pending = parts.pop()
+            yield from parts
+        yield pending
+
+
+class ExampleWriter():
+    """
+    writes the examples of a dataset as they are generated, through a buffered file
+    the file ends up the same as separator.join(examples) would have been, without holding the examples in memory
+    (compressed on the fly when path ends with ".gz", ".xz" or ".bz2", see open_file())
+    count is the number of examples written so far, size and checksum the number of bytes and the sha256 of the written
+    text (before compression)
+    """
+    def __init__(self, path, separator="\n\n", buffer_size=1 << 20):
+        self.path = path
+        self.separator = separator
+        # the examples are written as utf-8 bytes, the file holding the very text its size and checksum are computed on
+        self.file = open_file(path, "wb", buffering=buffer_size)
+        self.count = 0
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def write(self, example):
+        text = self.separator + example if self.count else example
+        data = text.encode("utf-8")
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+        self.count += 1
+
+    @property
+    def checksum(self):
+        return self.hash.hexdigest()
+
+    def write_all(self, examples):
+        for example in examples:
+            self.write(example)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+#____________________Snippet index________________________#
+
+SNIPPET_INDEX_MAGIC = b"TPYSNIX1"
+SNIPPET_INDEX_HEADER = struct.Struct("<8sQQQ") # magic, size and mtime (ns) of the indexed snippets file, number of snippets
+# a "\n\n" separator of the text read by open(path, 'r'), where "\r\n" and "\r" are read as "\n"
+SNIPPET_SEPARATOR = re.compile(rb"(?:\r\n|\r(?!\n)|\n){2}")
+
+
+def get_snippet_index_path(source_file_path):
+    return source_file_path + ".idx"
+
+
+def build_snippet_index(source_file_path, index_path=None):
+    # write the offset index of a snippets file : the (start, end) byte offsets of every snippet,
+    # the same snippets open(source_file_path).read().split('\n\n') gives, as an array of unsigned 64 bit integers
+    # the index is written next to the snippets file by default, return its path
+    index_path = index_path or get_snippet_index_path(source_file_path)
+    stat = os.stat(source_file_path)
+    offsets = array("Q")
+    with open(source_file_path, "rb") as f:
+        if stat.st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                start = 0
+                for separator in SNIPPET_SEPARATOR.finditer(content):
+                    offsets.extend((start, separator.start()))
+                    start = separator.end()
+        else:
+            start = 0
+        offsets.extend((start, stat.st_size))
+    temporary_path = index_path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(SNIPPET_INDEX_HEADER.pack(SNIPPET_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets) // 2))
+        offsets.tofile(f)
+    os.replace(temporary_path, index_path)
+    return index_path
+
+
+def load_snippet_index(source_file_path, index_path):
+    # return the offsets kept in the index, None if it is missing or does not match the snippets file anymore
+    stat = os.stat(source_file_path)
+    try:
+        with open(index_path, "rb") as f:
+            magic, size, mtime_ns, count = SNIPPET_INDEX_HEADER.unpack(f.read(SNIPPET_INDEX_HEADER.size))
+            if magic != SNIPPET_INDEX_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                return None
+            offsets = array("Q")
+            offsets.fromfile(f, 2 * count)
+    except (OSError, struct.error, EOFError):
+        return None
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    return offsets
+
+
+class SnippetCorpus():
+    """
+    random access to the snippets of a snippets file through its offset index (see build_snippet_index())
+    the file is memory mapped and corpus[k] decodes snippet k alone, the index is (re)built when it is missing
+    or older than the file
+    a corpus iterates over the snippets start to stop (all of them, unless it is a selection, see select()),
+    corpus[k] is snippet k of the file whatever the selection
+    a corpus is sent to worker processes as its paths, each process maps the file on its own
+    the snippets file can not be compressed (it is mapped as it is on disk)
+    """
+    def __init__(self, source_file_path, index_path=None):
+        if get_compression(source_file_path) is not None:
+            raise ValueError(f"{source_file_path} is compressed, the snippet index (and sharded output) needs an uncompressed snippets file")
+        self.source_file_path = source_file_path
+        self.index_path = index_path or get_snippet_index_path(source_file_path)
+        self.offsets = load_snippet_index(source_file_path, self.index_path)
+        if self.offsets is None:
+            build_snippet_index(source_file_path, self.index_path)
+            self.offsets = load_snippet_index(source_file_path, self.index_path)
+        self.file = open(source_file_path, "rb")
+        self.content = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(self.file.fileno()).st_size else b""
+        self.start = 0
+        self.stop = self.count = len(self.offsets) // 2
+
+    def select(self, start, stop):
+        # return the selection of the snippets start to stop (excluded) of the corpus, sharing its memory map
+        selection = copy.copy(self)
+        selection.start = min(max(start, 0), self.count)
+        selection.stop = min(max(stop, selection.start), self.count)
+        return selection
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, k):
+        if not 0 <= k < self.count:
+            raise IndexError("snippet index out of range")
+        snippet = self.content[self.offsets[2 * k]:self.offsets[2 * k + 1]].decode("utf-8")
+        if "\r" in snippet:
+            snippet = snippet.replace("\r\n", "\n").replace("\r", "\n")
+        return snippet
+
+    def __iter__(self):
+        for k in range(self.start, self.stop):
+            yield self[k]
+
+    def source_size(self, start, stop):
+        # number of bytes of the snippets file spanned by the snippets start to stop (excluded)
+        if start >= stop:
+            return 0
+        return self.offsets[2 * stop - 1] - self.offsets[2 * start]
+
+    def close(self):
+        if isinstance(self.content, mmap.mmap):
+            self.content.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def paths(self):
+        return (self.source_file_path, self.index_path)
+
+    def __getstate__(self):
+        return self.paths() + (self.start, self.stop)
+
+    def __setstate__(self, state):
+        self.__init__(*state[:2])
+        self.start, self.stop = state[2:]
+
+
+snippet_corpora = {} # corpora opened by get_snippet_corpus(), by (paths, process id) since a memory map is not shared with forked workers
+
+
+def get_snippet_corpus(source_file_path, index_path=None):
+    # return the SnippetCorpus of a snippets file, opened once per process
+    index_path = index_path or get_snippet_index_path(source_file_path)
+    key = (os.path.abspath(source_file_path), os.path.abspath(index_path), os.getpid())
+    if key not in snippet_corpora:
+        snippet_corpora[key] = SnippetCorpus(source_file_path, index_path)
+    return snippet_corpora[key]
+
+
+def open_snippets(source_file_path, snippet_index_path=None):
+    # the snippets of a snippets file : read sequentially (read_snippets()) without index,
+    # otherwise a SnippetCorpus giving random access to them through the index kept at snippet_index_path
+    if snippet_index_path is None:
+        return read_snippets(source_file_path)
+    return SnippetCorpus(source_file_path, snippet_index_path)
+
+
+#____________________Snippet deduplication________________________#
+
+STRING_START_TOKENS = {getattr(tokenize, name) for name in ("FSTRING_START", "TSTRING_START") if hasattr(tokenize, name)} # python 3.12+ splits f-strings into several tokens
+STRING_END_TOKENS = {getattr(tokenize, name) for name in ("FSTRING_END", "TSTRING_END") if hasattr(tokenize, name)}
+
+
+def get_string_spans(snippet):
+    # the (start, end) offsets of the string literals of a snippet, in the order of the snippet
+    # raises SyntaxError (or tokenize.TokenError) for a snippet that does not tokenize, an unterminated string included
+    line_offsets = [0]
+    for line in snippet.splitlines(keepends=True):
+        line_offsets.append(line_offsets[-1] + len(line))
+    spans = []
+    depth = 0
+    for token in tokenize.generate_tokens(io.StringIO(snippet).readline):
+        if token.type in STRING_START_TOKENS:
+            depth += 1
+            if depth == 1:
+                start = token.start
+        elif token.type in STRING_END_TOKENS:
+            depth -= 1
+            if depth == 0:
+                spans.append((start, token.end))
+        elif token.type == tokenize.STRING and depth == 0:
+            spans.append((token.start, token.end))
+        elif token.type == tokenize.ERRORTOKEN:
+            raise SyntaxError(f"unexpected {token.string!r}", ("<snippet>", token.start[0], token.start[1] + 1, token.line))
+    return [(line_offsets[start_row - 1] + start_col, line_offsets[end_row - 1] + end_col) for (start_row, start_col), (end_row, end_col) in spans]
+
+
+def normalize_snippet(snippet):
+    # the text shared by the snippets that only differ by whitespace : line endings, blank lines, trailing whitespace
+    # and runs of spaces or tabs inside a line are normalized, the indentation and the string literals are kept as they are
+    # (a snippet that does not tokenize only has its line endings normalized)
+    snippet = snippet.replace("\r\n", "\n").replace("\r", "\n")
+    if "\0" in snippet:
+        return snippet
+    try:
+        spans = get_string_spans(snippet)
+    except (SyntaxError, tokenize.TokenError):
+        return snippet
+    # every string literal is set aside behind a placeholder without whitespace while the rest is normalized
+    strings = [snippet[start:end] for start, end in spans]
+    parts = []
+    previous_end = 0
+    for number, (start, end) in enumerate(spans):
+        parts.append(snippet[previous_end:start] + f"\0{number}\0")
+        previous_end = end
+    parts.append(snippet[previous_end:])
+    lines = []
+    for line in "".join(parts).split("\n"):
+        code = line.lstrip(" \t")
+        if code.strip():
+            lines.append(line[:len(line) - len(code)] + " ".join(code.split()))
+    return re.sub("\0([0-9]+)\0", lambda match: strings[int(match.group(1))], "\n".join(lines))
+
+
+def get_snippet_key(snippet):
+    # the 16 bytes hash of the normalized snippet, the same for the snippets that only differ by whitespace
+    return hashlib.blake2b(normalize_snippet(snippet).encode("utf-8"), digest_size=16).digest()
+
+
+class SnippetDeduplicator():
+    """
+    tells whether a snippet is the same as a snippet seen before, once normalized (see normalize_snippet())
+    or exactly the same without normalize (e.g. the examples of a dataset)
+    the 16 bytes hashes of the snippets seen so far are kept in memory (about 80 bytes per distinct snippet), or with on_disk,
+    in a temporary sqlite file (deleted once closed) whose page cache is limited to cache_mb, memory then staying
+    bounded whatever the size of the corpus
+    duplicates is the number of snippets found to be duplicates so far
+    """
+    def __init__(self, on_disk=False, cache_mb=64, normalize=True):
+        self.on_disk = on_disk
+        self.normalize = normalize
+        self.duplicates = 0
+        if on_disk:
+            # an empty path gives a private database in the temporary directory
+            self.connection = sqlite3.connect("")
+            self.connection.execute(f"PRAGMA cache_size = {-cache_mb * 1024}")
+            self.connection.execute("PRAGMA journal_mode = OFF")
+            self.connection.execute("CREATE TABLE hashes (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+        else:
+            self.hashes = set()
+
+    def snippet_hash(self, snippet):
+        if self.normalize:
+            return get_snippet_key(snippet)
+        return hashlib.blake2b(snippet.encode("utf-8"), digest_size=16).digest()
+
+    def seen(self, snippet):
+        # return whether the snippet was seen before, and remember it
+        snippet_hash = self.snippet_hash(snippet)
+        if self.on_disk:
+            seen = self.connection.execute("INSERT OR IGNORE INTO hashes VALUES (?)", (snippet_hash,)).rowcount == 0
+        else:
+            seen = snippet_hash in self.hashes
+            self.hashes.add(snippet_hash)
+        self.duplicates += seen
+        return seen
+
+    def close(self):
+        if self.on_disk:
+            self.connection.close()
+        else:
+            self.hashes = set()
+
+
+SNIPPET_DEDUP_INDEX_MAGIC = b"TPYSNDD1"
+
+
+def get_snippet_dedup_index_path(index_path):
+    # the dedup index of a snippets file is kept next to its snippet index
+    return index_path + ".dedup"
+
+
+def build_snippet_dedup_index(corpus, dedup_index_path=None, on_disk=False, cache_mb=64):
+    # write the dedup index of the snippets file of a SnippetCorpus : for every snippet, the index of the first snippet of the file
+    # with the same key (see get_snippet_key()), its own index for a first occurrence, as an array of unsigned 64 bit integers
+    # after the header of the snippet index (size and mtime of the snippets file, number of snippets)
+    # the keys seen so far are kept in memory while it is built, or with on_disk in a temporary sqlite file whose page cache
+    # is limited to cache_mb, return the path of the index
+    dedup_index_path = dedup_index_path or get_snippet_dedup_index_path(corpus.index_path)
+    stat = os.stat(corpus.source_file_path)
+    first_occurrences = array("Q")
+    if on_disk:
+        connection = sqlite3.connect("")
+        connection.execute(f"PRAGMA cache_size = {-cache_mb * 1024}")
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("CREATE TABLE keys (key BLOB PRIMARY KEY, first INTEGER) WITHOUT ROWID")
+    else:
+        keys = {}
+    try:
+        for index in range(corpus.count):
+            key = get_snippet_key(corpus[index])
+            if not on_disk:
+                first_occurrences.append(keys.setdefault(key, index))
+            elif connection.execute("INSERT OR IGNORE INTO keys VALUES (?, ?)", (key, index)).rowcount:
+                first_occurrences.append(index)
+            else:
+                first_occurrences.append(connection.execute("SELECT first FROM keys WHERE key = ?", (key,)).fetchone()[0])
+    finally:
+        if on_disk:
+            connection.close()
+    if sys.byteorder != "little":
+        first_occurrences.byteswap()
+    # the nodes of a multi node run can build it at the same time, each one writes its own temporary file
+    temporary_path = f"{dedup_index_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(SNIPPET_INDEX_HEADER.pack(SNIPPET_DEDUP_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, corpus.count))
+        first_occurrences.tofile(f)
+    os.replace(temporary_path, dedup_index_path)
+    return dedup_index_path
+
+
+def load_snippet_dedup_index(corpus, dedup_index_path, start, stop):
+    # return the first occurrences kept in the dedup index for the snippets start to stop (excluded) alone,
+    # None if it is missing or does not match the snippets file anymore
+    stat = os.stat(corpus.source_file_path)
+    try:
+        with open(dedup_index_path, "rb") as f:
+            magic, size, mtime_ns, count = SNIPPET_INDEX_HEADER.unpack(f.read(SNIPPET_INDEX_HEADER.size))
+            if magic != SNIPPET_DEDUP_INDEX_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns or count != corpus.count:
+                return None
+            first_occurrences = array("Q")
+            f.seek(SNIPPET_INDEX_HEADER.size + first_occurrences.itemsize * start)
+            first_occurrences.fromfile(f, stop - start)
+    except (OSError, struct.error, EOFError):
+        return None
+    if sys.byteorder != "little":
+        first_occurrences.byteswap()
+    return first_occurrences
+
+
+def get_snippet_dedup_index(corpus, on_disk=False):
+    # return the path of the dedup index of a SnippetCorpus, (re)built when it is missing or older than the snippets file
+    dedup_index_path = get_snippet_dedup_index_path(corpus.index_path)
+    if load_snippet_dedup_index(corpus, dedup_index_path, 0, 0) is None:
+        build_snippet_dedup_index(corpus, dedup_index_path, on_disk)
+    return dedup_index_path
+
+
+def get_first_occurrences(corpus, on_disk=False):
+    # the first occurrences of the snippets of a SnippetCorpus (start to stop for a selection), see build_snippet_dedup_index()
+    first_occurrences = load_snippet_dedup_index(corpus, get_snippet_dedup_index(corpus, on_disk), corpus.start, corpus.stop)
+    if first_occurrences is None:
+        raise RuntimeError(f"the dedup index of {corpus.source_file_path} was replaced by an outdated one")
+    return first_occurrences
+
+
+#____________________Sharded output________________________#
+
+class DatasetReport():
+    """
+    what happened to the snippets of a dataset (or of a shard of it) : how many were processed, how many examples
+    they gave, how many went over their budget, crashed their worker or were dropped as duplicates, and why the others
+    were rejected (duplicate_examples counts the examples dropped for repeating the examples of earlier snippets)
+    """
+    def __init__(self):
+        self.processed_snippets = 0
+        self.generated_examples = 0
+        self.over_budget_snippets = 0
+        self.crashed_snippets = 0
+        self.duplicate_snippets = 0
+        self.duplicate_examples = 0
+        self.rejection_reasons = Counter()
+
+    def add(self, examples, status, reason):
+        # count the result of a snippet : its number of examples, its status and its rejection reason
+        self.processed_snippets += 1
+        self.generated_examples += examples
+        if status == "over_budget":
+            self.over_budget_snippets += 1
+        elif status == "crashed":
+            self.crashed_snippets += 1
+        elif status == "duplicate":
+            self.duplicate_snippets += 1
+        if reason:
+            self.rejection_reasons[reason] += 1
+
+    def merge(self, other):
+        self.processed_snippets += other.processed_snippets
+        self.generated_examples += other.generated_examples
+        self.over_budget_snippets += other.over_budget_snippets
+        self.crashed_snippets += other.crashed_snippets
+        self.duplicate_snippets += other.duplicate_snippets
+        self.duplicate_examples += other.duplicate_examples
+        self.rejection_reasons.update(other.rejection_reasons)
+        return self
+
+    def print(self, rejection_index_path=None, indent=""):
+        print(indent+"generated :",self.generated_examples," snippets")
+        print(indent+"skipped :",self.over_budget_snippets," snippets over their step/time budget")
+        print(indent+"rejected :",self.crashed_snippets," snippets that crashed their worker")
+        if self.duplicate_snippets:
+            print(indent+"dropped :",self.duplicate_snippets," duplicate snippets")
+        if self.duplicate_examples:
+            print(indent+"dropped :",self.duplicate_examples," duplicate examples")
+        print_rejection_report(self.rejection_reasons, rejection_index_path)
+
+
+def get_shard_path(path, shard, shard_count):
+    # path of shard number "shard" (0 based) of a file split into shard_count shards, e.g. data-00001-of-00004.txt
+    # (data-00001-of-00004.txt.gz for a compressed one)
+    stem, extension = split_extension(path)
+    return f"{stem}-{shard:05d}-of-{shard_count:05d}{extension}"
+
+
+def get_manifest_path(path, shard=None):
+    # manifest of a sharded dataset, or with shard = (shard, shard_count), the manifest a single node writes for its shard
+    if shard is not None:
+        path = get_shard_path(path, *shard)
+    return split_extension(path)[0]+"_manifest.json"
+
+
+def parse_shard_argument(arguments):
+    # return (shard, shard_count) given by a "--shard i/N" (or "--shard=i/N") command line argument, i going from 0 to N-1,
+    # None without it
+    for position, argument in enumerate(arguments):
+        if argument == "--shard" and position + 1 < len(arguments):
+            value = arguments[position + 1]
+        elif argument.startswith("--shard="):
+            value = argument[len("--shard="):]
+        else:
+            continue
+        try:
+            shard, shard_count = (int(part) for part in value.split("/"))
+        except ValueError:
+            raise ValueError(f"--shard expects i/N, got {value!r}") from None
+        if not 0 <= shard < shard_count:
+            raise ValueError(f"--shard {value} : the shard must go from 0 to {shard_count - 1}")
+        return shard, shard_count
+    return None
+
+
+def get_shard_ranges(corpus, shard_count):
+    # split the snippets of a SnippetCorpus into shard_count consecutive (start, stop) ranges spanning
+    # about the same number of bytes of the snippets file, the examples of a snippet growing with its size
+    starts = corpus.offsets[0::2]
+    total = corpus.source_size(0, corpus.count)
+    bounds = [0]
+    for shard in range(1, shard_count):
+        target = corpus.offsets[0] + total * shard // shard_count
+        bounds.append(max(bisect_left(starts, target), bounds[-1]))
+    bounds.append(corpus.count)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def describe_shard(writer, start, stop, log=None):
+    # manifest entry of a shard written by an ExampleWriter, holding the examples of the snippets start to stop
+    # (and of the shard of the log written along, if any), the bytes and sha256 being those of the text before compression
+    shard = {"path": os.path.basename(writer.path), "examples": writer.count, "bytes": writer.size, "sha256": writer.checksum, "snippets": [start, stop]}
+    if log is not None:
+        shard.update({"log_path": os.path.basename(log.path), "log_bytes": log.size, "log_sha256": log.checksum})
+    return shard
+
+
+def generate_shards(write_shard, corpus, shard_count, workers=1, sandbox=None, only_shard=None):
+    # run write_shard(shard, start, stop, workers, sandbox) for every shard of the snippets of a SnippetCorpus
+    # (see get_shard_ranges()) and yield its result, in the order of the shards
+    # with at least as many shards as workers, every worker process writes whole shards on its own,
+    # otherwise (or with a sandbox) the shards are written one after another, their snippets spread over the workers
+    # with only_shard, only that shard is written (a node of a multi node run, see parse_shard_argument())
+    # write_shard is sent to the workers, it must be a module level function or the method of a TaskRun
+    workers = get_worker_count(workers)
+    ranges = get_shard_ranges(corpus, shard_count)
+    if only_shard is not None:
+        start, stop = ranges[only_shard]
+        yield write_shard(only_shard, start, stop, workers, sandbox)
+        return
+    if workers == 1 or shard_count < workers or sandbox is not None:
+        for shard, (start, stop) in enumerate(ranges):
+            yield write_shard(shard, start, stop, workers, sandbox)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shards = [pool.submit(write_shard, shard, start, stop) for shard, (start, stop) in enumerate(ranges)]
+        for shard in tqdm(shards, desc="Writing Shards"):
+            yield shard.result()
+
+
+def write_manifest(path, source_file_path, shards):
+    # write the manifest of a sharded dataset : its shards (file, examples, bytes, sha256, snippet range) and their totals
+    # (a node of a multi node run writes the manifest of its single shard)
+    manifest = {
+        "source_file_path": source_file_path,
+        "shard_count": len(shards),
+        "examples": sum(shard["examples"] for shard in shards),
+        "bytes": sum(shard["bytes"] for shard in shards),
+        "shards": shards,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+
+
+def read_shard_manifests(destination_file_path, shard_count):
+    # return (source_file_path, shards) of a dataset split into shard_count shards : read from the manifests
+    # the nodes wrote for their shard, or without them, from the manifest of the dataset (written by a single run)
+    manifest_paths = [get_manifest_path(destination_file_path, (shard, shard_count)) for shard in range(shard_count)]
+    if not any(os.path.exists(path) for path in manifest_paths) and os.path.exists(get_manifest_path(destination_file_path)):
+        manifest_paths = [get_manifest_path(destination_file_path)]
+    missing = [path for path in manifest_paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"missing shard manifests {missing}")
+    source_file_path = None
+    shards = []
+    for path in manifest_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        source_file_path = source_file_path or manifest["source_file_path"]
+        shards.extend(manifest["shards"])
+    if len(shards) != shard_count:
+        raise ValueError(f"{destination_file_path} has {len(shards)} shards, expected {shard_count}")
+    for previous, shard in zip(shards, shards[1:]):
+        if previous["snippets"][1] != shard["snippets"][0]:
+            raise ValueError(f"the snippets of {previous['path']} and {shard['path']} are not consecutive")
+    return source_file_path, shards
+
+
+def join_shard_files(shard_paths, checksums, destination_file_path, separator, block_size=1 << 20):
+    # write the non empty shard files one after another, separated by separator, checking their (sha256, bytes) on the way
+    # compressed shards are decompressed and their text compressed again as a single stream (see open_file())
+    # the shards are written to a temporary file, which only replaces the destination once every shard matched
+    # (an existing destination is left untouched otherwise)
+    separator = separator.encode("utf-8")
+    written = False
+    temporary_path = destination_file_path + ".tmp"
+    try:
+        with open(temporary_path, "wb") as temporary, open_file(destination_file_path, "wb", fileobj=temporary) as destination:
+            for shard_path, (checksum, size) in zip(shard_paths, checksums):
+                shard_hash = hashlib.sha256()
+                shard_size = 0
+                with open_file(shard_path, "rb") as shard:
+                    for block in iter(lambda: shard.read(block_size), b""):
+                        if not shard_size and written:
+                            destination.write(separator)
+                        destination.write(block)
+                        shard_hash.update(block)
+                        shard_size += len(block)
+                        written = True
+                if shard_hash.hexdigest() != checksum or shard_size != size:
+                    raise ValueError(f"{shard_path} does not match its manifest (sha256 or size)")
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    os.replace(temporary_path, destination_file_path)
+
+
+def merge_shards(destination_file_path, shard_count):
+    # join the shards of a dataset (written by output_shards, or by the nodes of a multi node run) into
+    # destination_file_path, and the shards of its log into the log file, giving back the very files a single run writes
+    # the shards are checked against their manifest, whose entries are gathered in the manifest of the dataset
+    source_file_path, shards = read_shard_manifests(destination_file_path, shard_count)
+    directory = os.path.dirname(destination_file_path)
+    join_shard_files([os.path.join(directory, shard["path"]) for shard in shards], [(shard["sha256"], shard["bytes"]) for shard in shards], destination_file_path, "\n\n")
+    if "log_path" in shards[0]:
+        # the log of the dataset is the log of its first shard without the shard suffix
+        stem, extension = split_extension(shards[0]["log_path"])
+        log_file_path = os.path.join(directory, stem[:-len(f"-00000-of-{shard_count:05d}")] + extension)
+        join_shard_files([os.path.join(directory, shard["log_path"]) for shard in shards], [(shard["log_sha256"], shard["log_bytes"]) for shard in shards], log_file_path, "\n")
+    write_manifest(get_manifest_path(destination_file_path), source_file_path, shards)
+    return shards
+
+
+#____________________Sandboxed workers________________________#
+
+class SandboxLimits():
+    """
+    limits of the sandboxed worker processes
+    memory_mb : address space of a worker, in MB (0 means no limit)
+    cpu_seconds : cpu time a worker can spend on a single snippet (0 means no limit)
+    snippets_per_worker : a worker is replaced by a fresh one after processing that many snippets (0 means never)
+    a worker going over its memory gets MemoryErrors, one going over its cpu time is killed (SIGXCPU)
+    """
+    def __init__(self, memory_mb=0, cpu_seconds=0, snippets_per_worker=0):
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self.snippets_per_worker = snippets_per_worker
+
+
+def limit_worker_memory(memory_mb):
+    if resource is not None and memory_mb:
+        memory = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+
+def limit_snippet_cpu_time(cpu_seconds):
+    # RLIMIT_CPU counts the cpu time of the whole process, the soft limit is moved
+    # before every snippet to allow cpu_seconds more (the hard limit is left untouched)
+    if resource is not None and cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_CPU)
+        soft_limit = int(usage.ru_utime + usage.ru_stime) + cpu_seconds + 1
+        if hard_limit != resource.RLIM_INFINITY:
+            soft_limit = min(soft_limit, hard_limit)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft_limit, hard_limit))
+
+
+def run_sandboxed_worker(conn, process_snippet, sandbox, corpus_paths=None):
+    # worker process : receive (index, snippet) tasks one by one and send back their results, until it receives None
+    # with the paths of a SnippetCorpus, it only receives the index and reads the snippet from the corpus
+    # its pending rejections are written by batches and before it stops (a killed worker loses them,
+    # they are only a cache, the rejection of the snippet that crashed it is recorded by the parent)
+    limit_worker_memory(sandbox.memory_mb)
+    while True:
+        task = conn.recv()
+        if task is None:
+            flush_rejection_indexes()
+            break
+        index, snippet = task
+        if corpus_paths is not None:
+            snippet = get_snippet_corpus(*corpus_paths)[index]
+        limit_snippet_cpu_time(sandbox.cpu_seconds)
+        conn.send(process_snippet(index, snippet))
+    conn.close()
+
+
+class SandboxedWorker():
+    # a sandboxed worker process, the connection to it, and the index (and snippet) it is processing
+    def __init__(self, process_snippet, sandbox, corpus_paths=None):
+        self.conn, worker_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=run_sandboxed_worker, args=(worker_conn, process_snippet, sandbox, corpus_paths), daemon=True)
+        self.process.start()
+        worker_conn.close()
+        self.index = None
+        self.snippet = None
+        self.processed = 0
+
+    def send(self, index, snippet):
+        self.index = index
+        self.snippet = snippet
+        self.conn.send((index, snippet))
+
+    def receive(self):
+        # return (result, True) for the in-flight snippet, or (None, False) if the worker crashed while processing it
+        try:
+            if self.conn.poll():
+                return self.conn.recv(), True
+        except (EOFError, OSError):
+            pass
+        return None, False
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+def process_sandboxed(process_snippet, tasks, corpus, workers, sandbox, crashed_result, progress):
+    # process the (index, snippet) tasks in sandboxed workers, yielding the results in the order of the tasks
+    # a crashed (or killed) worker only loses its in-flight snippet, it is replaced by a fresh one
+    # at most max_buffered results wait for an earlier (slower) snippet, workers stay idle past that
+    # the snippets of a SnippetCorpus are read by the workers, they only receive the indexes
+    corpus_paths = corpus.paths() if corpus is not None else None
+    results = {}
+    sent = deque() # indexes of the tasks sent to the workers, in order
+    max_buffered = 16 * workers
+    pool = []
+    busy = []
+    idle = []
+
+    def feed(worker):
+        # give the worker its next snippet, return False if there is none (or too many results are waiting)
+        task = next(tasks, None) if len(results) < max_buffered else None
+        if task is None:
+            idle.append(worker)
+            return False
+        worker.send(*task)
+        sent.append(task[0])
+        busy.append(worker)
+        return True
+
+    try:
+        for _ in range(workers):
+            worker = SandboxedWorker(process_snippet, sandbox, corpus_paths)
+            pool.append(worker)
+            if not feed(worker):
+                break
+        while busy:
+            ready = wait([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy])
+            for worker in [worker for worker in busy if worker.conn in ready or worker.process.sentinel in ready]:
+                busy.remove(worker)
+                result, alive = worker.receive()
+                if not alive:
+                    result = crashed_result(worker.index, corpus[worker.index] if corpus_paths else worker.snippet)
+                results[worker.index] = result
+                worker.processed += 1
+                if not alive or (sandbox.snippets_per_worker and worker.processed >= sandbox.snippets_per_worker):
+                    worker.stop()
+                    pool.remove(worker)
+                    worker = SandboxedWorker(process_snippet, sandbox, corpus_paths)
+                    pool.append(worker)
+                feed(worker)
+            while sent and sent[0] in results:
+                progress.update(1)
+                yield results.pop(sent.popleft())
+            while idle and len(results) < max_buffered:
+                if not feed(idle.pop()):
+                    break
+    finally:
+        for worker in pool:
+            worker.stop()
+
+
+#____________________Rejection index________________________#
+
+class RejectionIndex():
+    """
+    persistent index of the snippets rejected by the tasks and of the reason why, kept in a sqlite file
+    a rejection is keyed by the sha256 of the snippet text and a scope : "" for the snippets failing to run
+    (rejected by every task), otherwise the scope of the task (its name and the hyperparameters its examples
+    depend on) for the snippets that went over their budget, crashed their worker, failed during the generation
+    or gave no examples
+    later runs skip the snippets it holds, giving them the same status as the run that rejected them
+    the rejections are kept in memory and written in one transaction every rejection_batch_size rejections, at the
+    end of every chunk (or worker) and before the summary, see flush_rejection_indexes()
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        # several workers can read and write the same index
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS rejections (snippet_hash TEXT, scope TEXT, status TEXT, reason TEXT, PRIMARY KEY (snippet_hash, scope))")
+        self.connection.commit()
+        self.pending = {} # {(snippet_hash, scope): (status, reason)} not written yet
+
+    @staticmethod
+    def snippet_hash(snippet):
+        return hashlib.sha256(snippet.encode("utf-8")).hexdigest()
+
+    def get(self, snippet, scope):
+        # return the (status, reason) of a snippet rejected for every task or for the scope, None if it was not rejected
+        snippet_hash = self.snippet_hash(snippet)
+        for key in ((snippet_hash, ""), (snippet_hash, scope)):
+            if key in self.pending:
+                return self.pending[key]
+        row = self.connection.execute("SELECT status, reason FROM rejections WHERE snippet_hash = ? AND scope IN ('', ?) ORDER BY scope LIMIT 1", (snippet_hash, scope)).fetchone()
+        return None if row is None else tuple(row)
+
+    def put(self, snippet, scope, status, reason):
+        self.pending[(self.snippet_hash(snippet), scope)] = (status, reason)
+        if len(self.pending) >= rejection_batch_size:
+            self.commit()
+
+    def commit(self):
+        # write the pending rejections in a single transaction
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO rejections VALUES (?, ?, ?, ?)", [key + value for key, value in self.pending.items()])
+        self.pending.clear()
+
+    def summary(self):
+        # return {reason: number of rejected snippets} over the whole index
+        self.commit()
+        return dict(self.connection.execute("SELECT reason, COUNT(*) FROM rejections GROUP BY reason ORDER BY COUNT(*) DESC").fetchall())
+
+
+rejection_indexes = {} # opened rejection indexes, by (path, process id) since a connection can not be shared with forked workers
+
+
+def get_rejection_index(path):
+    # return the RejectionIndex kept at path, None if path is None
+    if not path:
+        return None
+    key = (os.path.abspath(path), os.getpid())
+    if key not in rejection_indexes:
+        rejection_indexes[key] = RejectionIndex(path)
+    return rejection_indexes[key]
+
+
+def flush_rejection_indexes():
+    # write the pending rejections of the indexes opened by this process
+    for (path, pid), rejections in rejection_indexes.items():
+        if pid == os.getpid():
+            rejections.commit()
+
+
+def find_rejection(rejection_index_path, snippet, scope):
+    # return the (status, reason) a previous run rejected the snippet with, None if it was not rejected (or without index)
+    rejections = get_rejection_index(rejection_index_path)
+    if rejections is None:
+        return None
+    return rejections.get(snippet, scope)
+
+
+def record_rejection(rejection_index_path, snippet, scope, status, reason, fails_to_run=False):
+    # keep the rejection of a snippet (reason is "" for a snippet that gave examples, it is then not recorded)
+    # a snippet that fails to run is rejected for every task
+    rejections = get_rejection_index(rejection_index_path)
+    if rejections is not None and reason:
+        rejections.put(snippet, "" if fails_to_run else scope, status, reason)
+
+
+def print_rejection_report(rejection_reasons, rejection_index_path=None):
+    # print how many snippets were rejected for every reason during the run, and over the whole index
+    print("rejections :")
+    for reason, count in sorted(rejection_reasons.items(), key=lambda item: -item[1]):
+        print("   ",count," snippets :",reason)
+    rejections = get_rejection_index(rejection_index_path)
+    if rejections is not None:
+        print("rejection index ("+rejection_index_path+") :")
+        for reason, count in rejections.summary().items():
+            print("   ",count," snippets :",reason)
+
+
+#____________________Task scripts________________________#
+
+# a task script (line_execution_counting.py, operator_prediction.py ..etc) only holds its hyperparameters and the hooks
+# generating its examples, a TaskRun does the rest (budgets, shared runs, rejections, sweeps, datasets, logs, shards, manifests) :
+#   validate_snippet(snippet) : run the snippet once, raising the error of a snippet that fails to run
+#   generate_examples(index, snippet) : the examples of the snippet at position index of the source file
+#   get_rejection_scope(index) : the hyperparameters the rejections of the task depend on (see RejectionIndex)
+#   prepare_run(snippets, workers, sandbox) : (optional) called with the snippets of the source file before any of them is processed,
+#       returns the {name: value} hyperparameters of the script to use for the whole run (sent to the workers along with the TaskRun)
+# the hyperparameters a TaskRun reads from every task script :
+#   destination_file_path : the dataset, a ".gz", ".xz" or ".bz2" destination is compressed on the fly as the examples are written
+#   log_file_path : (optional) log of how many examples every snippet gave, next to the dataset (None writes no log)
+#   max_snippet_steps : maximum number of line events of a single execution of a snippet, snippets going over it are skipped (0 means no limit)
+#   max_snippet_seconds : maximum time spent on a single snippet, all of its executions included, snippets going over it are skipped
+#       (0 means no limit), the runs without line events (plain runs on CPython) are only stopped by a SIGALRM timer,
+#       which only exists on unix in the main thread, elsewhere they can go past it
+#   seed, snippet_rng_key : (optional) seed of the run, every snippet samples its examples with its own random generator derived
+#       from it and from snippet_rng_key, "index" (position of the snippet in the source file) or "content" (text of the snippet)
+#   sweep_configurations : (optional) hyperparameter overrides, one dataset per configuration generated from a single execution
+#       of every snippet, each configuration with its own destination_file_path (empty means a single dataset)
+#   deduplicate_examples_across_snippets : (optional) drop the examples already written to the dataset by earlier snippets, found
+#       through the hashes of their text (needs a single dataset file, not output_shards or --shard), kept in a temporary
+#       sqlite file instead of in memory (about 80 bytes per distinct example) with example_dedup_on_disk
+#   rejection_index_path : sqlite file remembering the snippets rejected by the task (failing to run, over budget, crashing
+#       or giving no examples) and why, later runs skip them (None disables it)
+# and the hyperparameters of the run, read from the script being run (the task script, or multi_task_generation.py) :
+#   source_file_path : the snippets, a ".gz", ".xz" or ".bz2" file is decompressed on the fly (snippet_index_path and output_shards need an uncompressed one)
+#   snippet_index_path : offset index of the snippets file (see index_snippets.py, rebuilt when missing or outdated), the snippets
+#       are then read from a memory map of the file with random access (None reads the file from start to end)
+#   output_shards : write every dataset as that many shards of about the same size (e.g. name-00000-of-00004.txt) with a manifest
+#       of their examples, bytes, sha256 and snippet ranges, worker processes writing their own shards, the snippets are read
+#       through the snippet index (written next to the snippets file when snippet_index_path is None) (0 writes a single file)
+#   deduplicate_snippets : skip the snippets that are the same as an earlier snippet of the source file up to whitespace
+#       (see normalize_snippet()), they are not processed and give no examples, with snippet_dedup_on_disk the hashes
+#       of the snippets seen so far are kept in a temporary sqlite file instead of in memory (about 80 bytes per distinct snippet),
+#       the snippets read through the snippet index (and the shards) are checked through a dedup index built once next to it
+#       (see build_snippet_dedup_index() and index_snippets.py)
+#   workers : how many worker processes generate the examples (0 means one per cpu), the output keeps the order of the snippets
+#   chunk_size : how many snippets are sent to a worker at once
+#   sandboxed_workers : process the snippets in recycled worker processes with resource limits, a crashing worker only loses its current snippet :
+#       worker_memory_limit_mb (address space of a worker, 0 means no limit), worker_cpu_limit_seconds (cpu time a worker can spend
+#       on a single snippet before being killed, 0 means no limit), snippets_per_worker (a worker is replaced by a fresh process
+#       after that many snippets, 0 means never)
+#   trace_store_path : sqlite file keeping the runs of the snippets from one run of the scripts to the next (and from one task
+#       to another), known snippets are read from it instead of being executed (None disables it)
+
+
+def process_task_snippet(script, index, snippet):
+    # generate the training examples of the snippet at position index of the source file for a task script (its module),
+    # returns (examples, status, reason), called inside the shared_runs() of TaskRun.process_snippet()
+    # status is "ok", "invalid" (the snippet fails to run) or "over_budget" (see max_snippet_steps/max_snippet_seconds)
+    # reason tells why the snippet was rejected ("" when it gave examples), a snippet already rejected by a previous run is skipped (see rejection_index_path)
+    scope = script.get_rejection_scope(index)
+    rejection = find_rejection(script.rejection_index_path, snippet, scope)
+    if rejection is not None:
+        status, reason = rejection
+        return [], status, reason
+    examples = []
+    validated = False
+    fails_to_run = False
+    try:
+        with snippet_budget(script.max_snippet_steps, script.max_snippet_seconds):
+            script.validate_snippet(snippet)
+            validated = True
+            examples = script.generate_examples(index, snippet)
+    except BudgetExceeded:
+        status, reason = "over_budget", "over its step/time budget"
+    except Exception as error:
+        status, reason = "invalid", ("generation error : " if validated else "fails to run : ")+type(error).__name__
+        # a snippet failing to run is rejected by every task, unless it only ran out of the memory of its worker
+        fails_to_run = not validated and not isinstance(error, MemoryError)
+    else:
+        status, reason = "ok", "" if examples else "no examples"
+    record_rejection(script.rejection_index_path, snippet, scope, status, reason, fails_to_run)
+    return examples, status, reason
+
+
+def crashed_task_result(script, index, snippet):
+    # result of a snippet that crashed its sandboxed worker, the crash is kept in the rejection index of the task script
+    record_rejection(script.rejection_index_path, snippet, script.get_rejection_scope(index), "crashed", "crashed its worker")
+    return [], "crashed", "crashed its worker"
+
+
+def get_log_line(index, examples, status):
+    # line of the log of a dataset for the snippet at position index : how many examples it gave, and why it gave none
+    if status in ("over_budget", "crashed", "duplicate"):
+        return str(index)+' 0 '+status
+    return str(index)+' '+str(len(examples))
+
+
+class TaskRun():
+    """
+    the datasets a run generates out of the snippets of the source file : one per configuration of the sweep_configurations
+    of each of its task scripts (see above), the hyperparameters of the run being read from run_script
+    task_scripts maps the directory of every task script (inside root_directory, "" for the script being run) to its
+    module name, the scripts are kept by name ("__main__" for the script being run) so that a TaskRun can be sent to workers
+    """
+    def __init__(self, run_script="__main__", task_scripts=None, root_directory=""):
+        self.run_script = run_script
+        self.task_scripts = task_scripts if task_scripts is not None else {"": run_script}
+        self.root_directory = root_directory
+        self.output_shards = 0
+        self.prepared_hyperparameters = {}
+
+    def settings(self):
+        # the module the hyperparameters of the run are read from
+        return importlib.import_module(self.run_script)
+
+    def datasets(self):
+        # (task directory, task script module, configuration) of every dataset of the run
+        datasets = []
+        for directory, name in self.task_scripts.items():
+            script = importlib.import_module(name)
+            for configuration in getattr(script, "sweep_configurations", None) or [{}]:
+                datasets.append((directory, script, configuration))
+        return datasets
+
+    def configure(self, directory, script, configuration):
+        # override the hyperparameters of the task script of directory for one of its datasets : with the ones its
+        # prepare_run() returned (see run()), then with the configuration of the dataset
+        return hyperparameters(vars(script), {**self.prepared_hyperparameters.get(directory, {}), **configuration})
+
+    def is_fused(self):
+        # whether the run generates the datasets of other scripts (multi_task_generation.py) rather than its own
+        return self.run_script not in self.task_scripts.values()
+
+    def process_snippet(self, index, snippet):
+        # generate the training examples of a single snippet for every dataset, returns a list of (examples, status, reason)
+        # the snippet is parsed, validated and run once for all of them (see shared_runs()), only the runs that depend on
+        # the task or on the configuration (sampled steps, masked snippets ..etc) are done per dataset
+        datasets = self.datasets()
+        # the step states are recorded once when several configurations of a sweep read different steps of the snippet
+        with shared_runs(share_step_states=len(datasets) > len(self.task_scripts), trace_store_path=self.settings().trace_store_path):
+            results = []
+            for directory, script, configuration in datasets:
+                with self.configure(directory, script, configuration):
+                    results.append(process_task_snippet(script, index, snippet))
+        return results
+
+    def crashed_result(self, index, snippet):
+        # result of a snippet that crashed its sandboxed worker, for every dataset
+        results = []
+        for directory, script, configuration in self.datasets():
+            with self.configure(directory, script, configuration):
+                results.append(crashed_task_result(script, index, snippet))
+        return results
+
+    def duplicate_result(self, index, snippet):
+        # result of a snippet dropped as the duplicate of an earlier snippet (see deduplicate_snippets), for every dataset
+        return [([], "duplicate", "duplicate of an earlier snippet") for _ in self.datasets()]
+
+    def process(self, snippets, workers, sandbox, desc="Processing Snippets"):
+        # the results of the snippets, in order (see process_in_order())
+        settings = self.settings()
+        deduplicator = SnippetDeduplicator(settings.snippet_dedup_on_disk) if settings.deduplicate_snippets else None
+        return process_in_order(self.process_snippet, snippets, workers, settings.chunk_size, desc=desc, sandbox=sandbox, crashed_result=self.crashed_result, deduplicator=deduplicator, duplicate_result=self.duplicate_result)
+
+    def get_destination_file_paths(self, shard=None):
+        # the dataset of every configuration of every task script, and its log (None for the scripts writing none),
+        # or their shard number "shard" (see output_shards)
+        destination_file_paths = []
+        log_file_paths = []
+        for directory, script, configuration in self.datasets():
+            path = configuration.get("destination_file_path", script.destination_file_path)
+            log_file_path = getattr(script, "log_file_path", None)
+            if log_file_path is not None and getattr(script, "sweep_configurations", None):
+                # every configuration of a sweep has its own log, named after its dataset
+                log_file_path = split_extension(path)[0]+"_"+log_file_path
+            destination_file_paths.append(os.path.join(self.root_directory, directory, path))
+            log_file_paths.append(None if log_file_path is None else os.path.join(self.root_directory, directory, log_file_path))
+        if len(set(destination_file_paths)) != len(destination_file_paths):
+            raise ValueError("every sweep configuration needs its own destination_file_path")
+        if shard is not None:
+            destination_file_paths = [get_shard_path(path, shard, self.output_shards) for path in destination_file_paths]
+            log_file_paths = [None if path is None else get_shard_path(path, shard, self.output_shards) for path in log_file_paths]
+        return destination_file_paths, log_file_paths
+
+    def deduplicates_examples(self):
+        # whether a dataset drops the examples already written by earlier snippets (see deduplicate_examples_across_snippets)
+        return any(configuration.get("deduplicate_examples_across_snippets", getattr(script, "deduplicate_examples_across_snippets", False)) for _, script, configuration in self.datasets())
+
+    def get_example_deduplicators(self):
+        # the SnippetDeduplicator of the examples written to every dataset, None for the datasets keeping them all
+        deduplicators = []
+        for directory, script, configuration in self.datasets():
+            with self.configure(directory, script, configuration):
+                deduplicators.append(SnippetDeduplicator(script.example_dedup_on_disk, normalize=False) if getattr(script, "deduplicate_examples_across_snippets", False) else None)
+        return deduplicators
+
+    def write_datasets(self, results, destination_file_paths, log_file_paths, first_index=0, example_deduplicators=None):
+        # write the examples and the log lines of the results (in the order of the snippets, starting at snippet first_index)
+        # of every dataset, return the DatasetReport of the snippets and the manifest entry of every dataset
+        # the examples an example deduplicator (see get_example_deduplicators()) already saw are left out
+        reports = [DatasetReport() for _ in destination_file_paths]
+        example_deduplicators = example_deduplicators or [None for _ in destination_file_paths]
+        with ExitStack() as files:
+            writers = [files.enter_context(ExampleWriter(path)) for path in destination_file_paths]
+            logs = [None if path is None else files.enter_context(ExampleWriter(path, separator="\n")) for path in log_file_paths]
+            for deduplicator in example_deduplicators:
+                if deduplicator is not None:
+                    files.callback(deduplicator.close)
+            for index, dataset_results in enumerate(results, first_index):
+                for i, (examples, status, reason) in enumerate(dataset_results):
+                    if example_deduplicators[i] is not None:
+                        kept = [example for example in examples if not example_deduplicators[i].seen(example)]
+                        reports[i].duplicate_examples += len(examples) - len(kept)
+                        examples = kept
+                    if logs[i] is not None:
+                        logs[i].write(get_log_line(index, examples, status))
+                    reports[i].add(len(examples), status, reason)
+                    writers[i].write_all(examples)
+        return [(report, describe_shard(writer, first_index, first_index + report.processed_snippets, log)) for report, writer, log in zip(reports, writers, logs)]
+
+    def write_shard(self, shard, start, stop, workers=1, sandbox=None):
+        # write shard number "shard" of every dataset and log (see output_shards) : the examples of the snippets start to stop
+        settings = self.settings()
+        snippets = get_snippet_corpus(settings.source_file_path, settings.snippet_index_path).select(start, stop)
+        results = self.process(snippets, workers, sandbox, desc=f"Shard {shard}")
+        return self.write_datasets(results, *self.get_destination_file_paths(shard), start)
+
+    def run(self, arguments):
+        # the main of the scripts : stream the snippets of the source file and write every dataset, or with a "--shard i/N"
+        # argument (a node of a multi node run) only shard i of N, merge_shards.py joins them afterwards
+        # the snippets are read, processed and written one at a time, so memory does not grow with
+        # the size of the source file or of the datasets
+        settings = self.settings()
+        print("--- Streaming the snippets of "+settings.source_file_path+" ---\n")
+        destination_file_paths, log_file_paths = self.get_destination_file_paths()
+        node_shard = parse_shard_argument(arguments)
+        self.output_shards = settings.output_shards if node_shard is None else node_shard[1]
+        sandbox = SandboxLimits(settings.worker_memory_limit_mb, settings.worker_cpu_limit_seconds, settings.snippets_per_worker) if settings.sandboxed_workers else None
+        if self.output_shards and self.deduplicates_examples():
+            raise ValueError("deduplicate_examples_across_snippets needs a single dataset file, it can not be used with output_shards (or --shard)")
+        for directory, name in self.task_scripts.items():
+            script = importlib.import_module(name)
+            if hasattr(script, "prepare_run"):
+                self.prepared_hyperparameters[directory] = script.prepare_run(open_snippets(settings.source_file_path, settings.snippet_index_path), settings.workers, sandbox)
+        if self.output_shards and settings.deduplicate_snippets:
+            # built once before the shards (and their workers) read it
+            get_snippet_dedup_index(get_snippet_corpus(settings.source_file_path, settings.snippet_index_path), settings.snippet_dedup_on_disk)
+        if self.output_shards:
+            reports = [DatasetReport() for _ in destination_file_paths]
+            shards = [[] for _ in destination_file_paths]
+            for shard_results in generate_shards(self.write_shard, get_snippet_corpus(settings.source_file_path, settings.snippet_index_path), self.output_shards, settings.workers, sandbox, None if node_shard is None else node_shard[0]):
+                for i, (shard_report, shard) in enumerate(shard_results):
+                    reports[i].merge(shard_report)
+                    shards[i].append(shard)
+            destination_file_paths = [get_manifest_path(path, node_shard) for path in destination_file_paths]
+            for path, dataset_shards in zip(destination_file_paths, shards):
+                write_manifest(path, settings.source_file_path, dataset_shards)
+        else:
+            results = self.process(open_snippets(settings.source_file_path, settings.snippet_index_path), settings.workers, sandbox)
+            reports = [report for report, _ in self.write_datasets(results, destination_file_paths, log_file_paths, example_deduplicators=self.get_example_deduplicators())]
+        self.print_reports(reports, destination_file_paths)
+
+    def print_reports(self, reports, destination_file_paths):
+        # print the DatasetReport of every dataset, and where it was written
+        print(f"Successfully processed {reports[0].processed_snippets} snippets.")
+        datasets = self.datasets()
+        for i, ((directory, script, configuration), report, path) in enumerate(zip(datasets, reports, destination_file_paths)):
+            if self.is_fused():
+                print(directory, ":" if not configuration else ": "+repr(configuration))
+                report.print(script.rejection_index_path, indent="    ")
+                print("    written to :"+path)
+                continue
+            if configuration:
+                print(path, ":", configuration)
+            # the rejection index is shared by the configurations, it is summed up once
+            report.print(script.rejection_index_path if i == len(datasets) - 1 else None)
+            print("Done, sucessfully written to :"+path)
+        if self.is_fused():
+            print("Done")
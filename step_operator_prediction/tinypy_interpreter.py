@@ -0,0 +1,692 @@
+import ast
+import os
+import sys
+import pickle
+import sqlite3
+import hashlib
+import builtins
+import operator
+from io import StringIO
+from contextlib import redirect_stdout, contextmanager
+from functools import lru_cache
+from tinypy_code_tracer_engine import build_function_source, compile_snippet, StepsCaptured, limit_steps, snippet_budget, budget_paused, BudgetExceeded, get_execution_trace
+
+
+
+#____________________Hyper Parameters________________________#
+program_cache_size = 256 # how many compiled programs to keep around
+max_stored_steps = 10000 # with a trace store, the variable states of every step are only recorded and stored for the snippets of at most that many steps, longer snippets record their sampled steps again on every run (0 means no limit)
+#____________________Supported subset________________________#
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+}
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+    ast.Invert: operator.invert,
+}
+COMPARATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+CALLABLE_BUILTINS = {"print", "range", "abs", "min", "max", "int", "float", "str", "bool", "len", "round"}
+
+
+class UnsupportedSnippet(Exception):
+    # raised while compiling a snippet that uses anything outside of the tinypy subset
+    pass
+
+
+#____________________Compilation to closures________________________#
+
+def load_variable(env, name):
+    # value of a variable, an unbound one raises a NameError just like CPython
+    try:
+        return env[name]
+    except KeyError:
+        raise NameError(f"name {name!r} is not defined") from None
+
+
+def compile_expression(node, assigned_names):
+    # given an expression node, return a closure evaluating it : closure(env) -> value
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda env: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in assigned_names:
+            return lambda env: load_variable(env, name)
+        if name in CALLABLE_BUILTINS:
+            value = getattr(builtins, name)
+            return lambda env: value
+        raise UnsupportedSnippet(f"unknown name {name!r}")
+
+    if isinstance(node, ast.BinOp):
+        op = BINARY_OPERATORS.get(type(node.op))
+        if op is None:
+            raise UnsupportedSnippet(f"unsupported operator {type(node.op).__name__}")
+        left = compile_expression(node.left, assigned_names)
+        right = compile_expression(node.right, assigned_names)
+        return lambda env: op(left(env), right(env))
+
+    if isinstance(node, ast.UnaryOp):
+        op = UNARY_OPERATORS.get(type(node.op))
+        if op is None:
+            raise UnsupportedSnippet(f"unsupported operator {type(node.op).__name__}")
+        operand = compile_expression(node.operand, assigned_names)
+        return lambda env: op(operand(env))
+
+    if isinstance(node, ast.Compare):
+        left = compile_expression(node.left, assigned_names)
+        comparisons = []
+        for op_node, comparator in zip(node.ops, node.comparators):
+            op = COMPARATORS.get(type(op_node))
+            if op is None:
+                raise UnsupportedSnippet(f"unsupported comparator {type(op_node).__name__}")
+            comparisons.append((op, compile_expression(comparator, assigned_names)))
+        if len(comparisons) == 1:
+            op, right = comparisons[0]
+            return lambda env: op(left(env), right(env))
+
+        def compare_chain(env):
+            # same as CPython : stop at the first false comparison and return its result
+            left_value = left(env)
+            for op, right in comparisons:
+                right_value = right(env)
+                result = op(left_value, right_value)
+                if not result:
+                    return result
+                left_value = right_value
+            return result
+        return compare_chain
+
+    if isinstance(node, ast.BoolOp):
+        values = [compile_expression(value, assigned_names) for value in node.values]
+        if isinstance(node.op, ast.And):
+            def bool_and(env):
+                for value in values:
+                    result = value(env)
+                    if not result:
+                        return result
+                return result
+            return bool_and
+        else:
+            def bool_or(env):
+                for value in values:
+                    result = value(env)
+                    if result:
+                        return result
+                return result
+            return bool_or
+
+    if isinstance(node, ast.IfExp):
+        test = compile_expression(node.test, assigned_names)
+        body = compile_expression(node.body, assigned_names)
+        orelse = compile_expression(node.orelse, assigned_names)
+        return lambda env: body(env) if test(env) else orelse(env)
+
+    if isinstance(node, ast.Call):
+        if node.keywords or not isinstance(node.func, ast.Name) or any(isinstance(arg, ast.Starred) for arg in node.args):
+            raise UnsupportedSnippet("unsupported call")
+        # only the usual builtins are called, a call through a variable (even one bound to a builtin) goes through CPython
+        if node.func.id not in CALLABLE_BUILTINS or node.func.id in assigned_names:
+            raise UnsupportedSnippet(f"unsupported call of {node.func.id!r}")
+        func = getattr(builtins, node.func.id)
+        args = [compile_expression(arg, assigned_names) for arg in node.args]
+        return lambda env: func(*[arg(env) for arg in args])
+
+    raise UnsupportedSnippet(f"unsupported expression {type(node).__name__}")
+
+
+def compile_block(body, assigned_names):
+    # given a list of statements, return a closure running them : closure(env, step)
+    # step(line_index, env) is called right before every statement runs, and again by loop
+    # headers after every iteration, exactly where CPython reports its line events
+    statements = [compile_statement(stmt, assigned_names) for stmt in body]
+    if len(statements) == 1:
+        return statements[0]
+
+    def run_block(env, step):
+        for statement in statements:
+            statement(env, step)
+    return run_block
+
+
+def compile_statement(stmt, assigned_names):
+    # given a statement node, return a closure running it : closure(env, step)
+    line_index = stmt.lineno - 1
+
+    if isinstance(stmt, ast.Assign):
+        if len(stmt.targets) != 1 or not isinstance(stmt.targets[0], ast.Name):
+            raise UnsupportedSnippet("unsupported assignment target")
+        name = stmt.targets[0].id
+        value = compile_expression(stmt.value, assigned_names)
+
+        def run_assign(env, step):
+            step(line_index, env)
+            env[name] = value(env)
+        return run_assign
+
+    if isinstance(stmt, ast.AugAssign):
+        op = BINARY_OPERATORS.get(type(stmt.op))
+        if op is None or not isinstance(stmt.target, ast.Name):
+            raise UnsupportedSnippet("unsupported augmented assignment")
+        # same in-place operator as CPython (it behaves like the plain one on numbers and strings)
+        op = getattr(operator, "i" + op.__name__.rstrip("_"))
+        name = stmt.target.id
+        value = compile_expression(stmt.value, assigned_names)
+
+        def run_aug_assign(env, step):
+            step(line_index, env)
+            env[name] = op(load_variable(env, name), value(env))
+        return run_aug_assign
+
+    if isinstance(stmt, ast.Expr):
+        value = compile_expression(stmt.value, assigned_names)
+
+        def run_expression(env, step):
+            step(line_index, env)
+            value(env)
+        return run_expression
+
+    if isinstance(stmt, ast.Pass):
+        def run_pass(env, step):
+            step(line_index, env)
+        return run_pass
+
+    if isinstance(stmt, ast.If):
+        test = compile_expression(stmt.test, assigned_names)
+        body = compile_block(stmt.body, assigned_names)
+        orelse = compile_block(stmt.orelse, assigned_names) if stmt.orelse else None
+
+        def run_if(env, step):
+            step(line_index, env)
+            if test(env):
+                body(env, step)
+            elif orelse is not None:
+                orelse(env, step)
+        return run_if
+
+    if isinstance(stmt, ast.For):
+        if not isinstance(stmt.target, ast.Name):
+            raise UnsupportedSnippet("unsupported loop target")
+        name = stmt.target.id
+        iterable = compile_expression(stmt.iter, assigned_names)
+        body = compile_block(stmt.body, assigned_names)
+        orelse = compile_block(stmt.orelse, assigned_names) if stmt.orelse else None
+
+        def run_for(env, step):
+            step(line_index, env)
+            for item in iterable(env):
+                env[name] = item
+                body(env, step)
+                step(line_index, env)
+            if orelse is not None:
+                orelse(env, step)
+        return run_for
+
+    if isinstance(stmt, ast.While):
+        test = compile_expression(stmt.test, assigned_names)
+        body = compile_block(stmt.body, assigned_names)
+        orelse = compile_block(stmt.orelse, assigned_names) if stmt.orelse else None
+
+        def run_while(env, step):
+            step(line_index, env)
+            while test(env):
+                body(env, step)
+                step(line_index, env)
+            if orelse is not None:
+                orelse(env, step)
+        return run_while
+
+    raise UnsupportedSnippet(f"unsupported statement {type(stmt).__name__}")
+
+
+def collect_variables(body, assigned_names, reached_lines):
+    # given a list of statements, add every variable they assign to assigned_names
+    # while checking that the statements are laid out the way the tinypy snippets are :
+    # one statement per line, single line statements/headers (their line events are then
+    # easy to predict), and no variable shadowing a builtin
+    for stmt in body:
+        if stmt.lineno in reached_lines:
+            raise UnsupportedSnippet("several statements on the same line")
+        reached_lines.add(stmt.lineno)
+        if isinstance(stmt, (ast.If, ast.While)):
+            header = stmt.test
+        elif isinstance(stmt, ast.For):
+            header = stmt.iter
+        else:
+            header = stmt
+        if header.end_lineno != stmt.lineno:
+            raise UnsupportedSnippet("statement spanning several lines")
+
+        if isinstance(stmt, ast.Assign):
+            targets = stmt.targets
+        elif isinstance(stmt, (ast.AugAssign, ast.For)):
+            targets = [stmt.target]
+        else:
+            targets = []
+        for target in targets:
+            if isinstance(target, ast.Name):
+                if hasattr(builtins, target.id):
+                    raise UnsupportedSnippet(f"variable {target.id!r} shadows a builtin")
+                assigned_names.add(target.id)
+
+        if isinstance(stmt, (ast.If, ast.For, ast.While)):
+            collect_variables(stmt.body, assigned_names, reached_lines)
+            collect_variables(stmt.orelse, assigned_names, reached_lines)
+
+
+def get_state_order(code_snippet):
+    # on python 3.13+ a frame's f_locals lists the variables in the order of co_varnames
+    # instead of the order they were first bound in, return that order so that the
+    # states match what the tracer would have captured (None on older interpreters)
+    if sys.version_info < (3, 13):
+        return None
+    func_code = next(const for const in compile_snippet(build_function_source(code_snippet)).co_consts if hasattr(const, "co_varnames"))
+    return {name: i for i, name in enumerate(func_code.co_varnames)}
+
+
+#____________________Shared runs________________________#
+
+class SharedRuns():
+    """
+    runs of the snippet being processed, see shared_runs()
+    results maps (kind, code_snippet) to the (result, error) pair of a run
+    share_step_states : whether the steps are recorded once with all of their variable states
+    store : TraceStore the runs are read from and written to (None keeps them in memory only)
+    the steps of the snippets of at most max_stored_steps steps are also recorded once when there is a store,
+    so that their states are stored
+    """
+    def __init__(self, share_step_states=False, store=None):
+        self.results = {}
+        self.share_step_states = share_step_states
+        self.store = store
+        self.new_runs = []
+
+
+active_runs = None # SharedRuns of the snippet being processed, None outside of shared_runs()
+
+
+@contextmanager
+def shared_runs(share_step_states=False, trace_store_path=None):
+    # inside this block, the plain runs of a snippet (its final variables, its steps without their states)
+    # are only done once, and reused by every helper (or task) asking for them again
+    # with share_step_states, the steps are also recorded once with all of their variable states, and every
+    # record_steps() reads its captured steps from that recording (worth it when several sampling configurations
+    # read different steps of the same snippet, see sweep_configurations)
+    # with a trace_store_path, the runs are also kept in a TraceStore, later runs of the same snippet
+    # (by any task, in any later run of the scripts) read them from it instead of executing the snippet,
+    # the states of every step being recorded once (and stored) for the snippets of at most max_stored_steps steps
+    # nested blocks share the runs of the outermost one
+    global active_runs
+    if active_runs is not None:
+        yield active_runs
+        return
+    store = get_trace_store(trace_store_path) if trace_store_path else None
+    active_runs = SharedRuns(share_step_states, store)
+    try:
+        yield active_runs
+    finally:
+        if store is not None:
+            # a slow write is not the snippet going over its budget
+            with budget_paused():
+                store.put(active_runs.new_runs)
+        active_runs = None
+
+
+def get_shared_run(kind, code_snippet, run, persist=True):
+    # return run(), only calling it once per (kind, code_snippet) inside shared_runs()
+    # a snippet raising an error raises it again every time, without being executed again
+    # with persist, the result is also kept in the trace store (if any), it then has to be picklable
+    # and only depend on the snippet text and on kind
+    if active_runs is None:
+        return run()
+    key = (kind, code_snippet)
+    if key not in active_runs.results:
+        stored = active_runs.store.get(kind, code_snippet) if persist and active_runs.store is not None else None
+        if stored is not None:
+            active_runs.results[key] = stored
+        else:
+            try:
+                active_runs.results[key] = (run(), None)
+            except Exception as error:
+                active_runs.results[key] = (None, error)
+            if persist:
+                active_runs.new_runs.append((kind, code_snippet, active_runs.results[key]))
+    result, error = active_runs.results[key]
+    if error is not None:
+        raise error
+    return result
+
+
+#____________________Trace store________________________#
+
+class TraceStore():
+    """
+    persistent, content-addressed store of the shared runs of the snippets, kept in a sqlite file
+    a run is keyed by the sha256 of the snippet text, its kind and the python version (python 3.13+
+    lists the variable states in another order), its (result, error) pair is pickled
+    runs that can not be pickled (a snippet binding a module or a function ..etc) are not kept,
+    and neither are the runs stopped by the step/time budget, nor the states of the steps of a snippet
+    of more than max_stored_steps steps
+    a stored run is reused as it is, whatever the budget of the later runs
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        # several workers can read and write the same store
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS runs (snippet_hash TEXT, kind TEXT, result BLOB, PRIMARY KEY (snippet_hash, kind))")
+        self.connection.commit()
+
+    @staticmethod
+    def key(kind, code_snippet):
+        snippet_hash = hashlib.sha256(code_snippet.encode("utf-8")).hexdigest()
+        return snippet_hash, f"{kind!r} python{sys.version_info[0]}.{sys.version_info[1]}"
+
+    def get(self, kind, code_snippet):
+        # return the stored (result, error) pair of a run, or None if the run is not stored
+        row = self.connection.execute("SELECT result FROM runs WHERE snippet_hash = ? AND kind = ?", self.key(kind, code_snippet)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def put(self, runs):
+        # store (kind, code_snippet, (result, error)) runs
+        rows = []
+        for kind, code_snippet, outcome in runs:
+            try:
+                rows.append(self.key(kind, code_snippet) + (pickle.dumps(outcome, pickle.HIGHEST_PROTOCOL),))
+            except Exception:
+                continue
+        if rows:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO runs VALUES (?, ?, ?)", rows)
+
+
+trace_stores = {} # opened trace stores, by (path, process id) since a connection can not be shared with forked workers
+
+
+def get_trace_store(path):
+    key = (os.path.abspath(path), os.getpid())
+    if key not in trace_stores:
+        trace_stores[key] = TraceStore(path)
+    return trace_stores[key]
+
+
+#____________________Programs________________________#
+
+class StepRecorder():
+    """
+    receives every step of a program run
+    lines holds the line index (0 based) of every step, step number N (1 based) being lines[N-1]
+    states maps the captured step numbers to their variable states, a tuple of (name, value) pairs
+    capture_steps is the set of step numbers to capture (None captures every step, an empty set none)
+    with stop_when_captured, the run is stopped (StepsCaptured) right after the last of them
+    """
+    def __init__(self, capture_steps=None, state_order=None, stop_when_captured=False):
+        self.lines = []
+        self.states = {}
+        self.capture_steps = capture_steps
+        self.state_order = state_order
+        self.stop_when_captured = stop_when_captured and capture_steps is not None
+
+    def snapshot(self, env):
+        if self.state_order is None:
+            return tuple(env.items())
+        return tuple(sorted(env.items(), key=lambda item: self.state_order[item[0]]))
+
+    def step(self, line_index, env):
+        self.lines.append(line_index)
+        if self.capture_steps is None or len(self.lines) in self.capture_steps:
+            self.states[len(self.lines)] = self.snapshot(env)
+            if self.stop_when_captured and len(self.states) == len(self.capture_steps):
+                raise StepsCaptured()
+
+
+class LineCounter():
+    # lightweight recorder that only counts the steps
+    def __init__(self):
+        self.count = 0
+
+    def step(self, line_index, env):
+        self.count += 1
+
+
+class LineCollector():
+    # lightweight recorder that only collects the executed line indexes (1 based)
+    def __init__(self):
+        self.lines = set()
+
+    def step(self, line_index, env):
+        self.lines.add(line_index + 1)
+
+
+def ignore_step(line_index, env):
+    pass
+
+
+class TinypyProgram():
+    """
+    a tinypy snippet compiled into closures
+    running it produces the final variable states (in the order they were first bound)
+    and reports every step to a recorder, without any tracer
+    raises UnsupportedSnippet if the snippet is outside of the tinypy subset
+    """
+    def __init__(self, code_snippet, tree=None):
+        if tree is None:
+            tree = ast.parse(code_snippet)
+        assigned_names = set()
+        collect_variables(tree.body, assigned_names, set())
+        self.code_snippet = code_snippet
+        self.run_body = compile_block(tree.body, assigned_names)
+        self.state_order = get_state_order(code_snippet)
+
+    def run(self, step=ignore_step):
+        env = {}
+        self.run_body(env, limit_steps(step))
+        return env
+
+    def shared_run(self):
+        # inside shared_runs(), a single run gives the final variables and the line index of every step
+        # to final_states(), count_lines(), executed_lines() and record_steps() without captured steps
+        def run():
+            recorder = StepRecorder(set())
+            env = self.run(recorder.step)
+            return env, recorder.lines
+        return get_shared_run("interpreter", self.code_snippet, run)
+
+    def final_states(self):
+        if active_runs is not None:
+            return dict(self.shared_run()[0])
+        return self.run()
+
+    def count_lines(self):
+        if active_runs is not None:
+            return len(self.shared_run()[1])
+        counter = LineCounter()
+        self.run(counter.step)
+        return counter.count
+
+    def executed_lines(self):
+        if active_runs is not None:
+            return {line_index + 1 for line_index in self.shared_run()[1]}
+        collector = LineCollector()
+        self.run(collector.step)
+        return collector.lines
+
+    def stores_steps(self):
+        # whether the states of every step of the snippet are kept in the trace store of shared_runs()
+        # (only for the snippets of at most max_stored_steps steps, the recording of a long loop being unbounded)
+        if active_runs.store is None:
+            return False
+        try:
+            return not max_stored_steps or len(self.shared_run()[1]) <= max_stored_steps
+        except Exception:
+            return False
+
+    def shared_steps(self, capture_steps=None, stop_when_captured=False, persist=True):
+        # same recorder as record_steps(), read from a single run capturing the states of every step
+        # (see shared_runs(share_step_states=True)), kept in the trace store with persist
+        def run():
+            recorder = StepRecorder(None, self.state_order)
+            try:
+                self.run(recorder.step)
+            except Exception as error:
+                # a run stopped before the error (stop_when_captured) still gets its steps
+                return recorder.lines, recorder.states, error
+            return recorder.lines, recorder.states, None
+        lines, states, error = get_shared_run("interpreter_steps", self.code_snippet, run, persist)
+        recorder = StepRecorder(capture_steps, self.state_order, stop_when_captured)
+        last_step = len(lines)
+        if recorder.stop_when_captured and capture_steps and max(capture_steps) <= last_step:
+            last_step = max(capture_steps)
+        elif error is not None:
+            raise error
+        recorder.lines = lines[:last_step]
+        recorder.states = {step: step_states for step, step_states in states.items() if step <= last_step and (capture_steps is None or step in capture_steps)}
+        return recorder
+
+    def record_steps(self, capture_steps=None, stop_when_captured=False):
+        if active_runs is not None and capture_steps is not None and not capture_steps:
+            recorder = StepRecorder(capture_steps, self.state_order, stop_when_captured)
+            recorder.lines = list(self.shared_run()[1])
+            return recorder
+        if active_runs is not None:
+            stored = self.stores_steps()
+            if stored or active_runs.share_step_states:
+                return self.shared_steps(capture_steps, stop_when_captured, stored)
+        recorder = StepRecorder(capture_steps, self.state_order, stop_when_captured)
+        try:
+            self.run(recorder.step)
+        except StepsCaptured:
+            pass
+        return recorder
+
+
+@lru_cache(maxsize=program_cache_size)
+def compile_tinypy(code_snippet):
+    # given a code snippet, return its TinypyProgram
+    # or None if the snippet is outside the tinypy subset (it then has to go through CPython)
+    # syntax errors are raised like compile() would, any other error while compiling the closures
+    # also leaves the snippet to CPython rather than rejecting it
+    # a snippet without any statement is left to CPython too, its traced run reports a single line
+    tree = ast.parse(code_snippet)
+    if not tree.body:
+        return None
+    try:
+        return TinypyProgram(code_snippet, tree)
+    except Exception:
+        return None
+
+
+# "interpreter" runs the snippets in the tinypy subset with TinypyProgram, CPython runs the others
+EXECUTION_ENGINES = ("interpreter", "cpython")
+
+
+def execute_snippet(code_snippet, engine="interpreter"):
+    # run a snippet and return its final variables (name -> value, in the order they were first bound)
+    # the same way exec(code_snippet, {}, local_scope) would fill local_scope
+    if engine not in EXECUTION_ENGINES:
+        raise ValueError(f"unknown execution engine {engine!r}, expected one of {EXECUTION_ENGINES}")
+    program = compile_tinypy(code_snippet) if engine == "interpreter" else None
+    if program is None:
+        def run():
+            local_scope = {}
+            exec(compile_snippet(code_snippet), {}, local_scope)
+            return local_scope
+        return dict(get_shared_run("cpython", code_snippet, run))
+    return program.final_states()
+
+
+def run_snippet(code_snippet, engine="interpreter"):
+    # run a snippet the way exec(code_snippet, {}) does, with a single namespace (so that its lambdas and
+    # comprehensions see its variables), raising the error of a snippet that fails to run
+    if engine not in EXECUTION_ENGINES:
+        raise ValueError(f"unknown execution engine {engine!r}, expected one of {EXECUTION_ENGINES}")
+    program = compile_tinypy(code_snippet) if engine == "interpreter" else None
+    if program is None:
+        get_shared_run("cpython_run", code_snippet, lambda: exec(compile_snippet(code_snippet), {}))
+        return
+    program.final_states()
+
+
+#____________________Evaluation________________________#
+
+def get_states_at_line(code_snippet, line_index):
+    # evaluation helper : run a snippet and return the variable states (as "a?1;b?2" strings)
+    # of every step that reached the line line_index (0 based), in the order they were reached
+    # a stepped answer is correct if the states of the example are one of them
+    # snippets outside of the tinypy subset are traced (see get_execution_trace())
+    program = compile_tinypy(code_snippet)
+    if program is None:
+        trace = get_execution_trace(code_snippet, engine="traced")
+        return [variable_states for variable_states, highlighted_line_nb, _, _ in trace.steps if highlighted_line_nb == line_index]
+    recorder = StepRecorder(set(), program.state_order)
+    states = []
+
+    def step(step_line_index, env):
+        if step_line_index == line_index:
+            states.append(";".join([f"{key}?{value:}" for key, value in recorder.snapshot(env)]))
+    # the snippet's prints are not part of the states
+    SIO = StringIO()
+    with redirect_stdout(SIO):
+        program.run(step)
+    return states
+
+
+def parse_states(variable_states):
+    # "a?1;b?2" -> [("a", "1"), ("b", "2")]
+    if not variable_states:
+        return []
+    return [tuple(state.split("?", 1)) for state in variable_states.split(";")]
+
+
+def states_match(example_states, states):
+    # whether the states of a step are the states of an example, up to the masked states ("~") of the example
+    example_states = parse_states(example_states)
+    states = parse_states(states)
+    return len(example_states) == len(states) and all(
+        example_key == key and (example_value == "~" or example_value == value)
+        for (example_key, example_value), (key, value) in zip(example_states, states)
+    )
+
+
+def is_stepped_answer_correct(prompt, answer, max_steps=1000000, max_seconds=10):
+    # evaluation of a stepped example (operator or input prediction) : prompt is the example up to its
+    # "# operator?" / "# input?" label, answer the predicted operator or value
+    # the masked "?" of the snippet is replaced with the answer, and the answer is correct if the snippet
+    # reaches the highlighted line (@line$states) with the states of the example at least once
+    # a snippet failing to run or going over the budget (see snippet_budget()) is a wrong answer
+    code_lines = prompt.split("\n")[:-1]
+    for line_index, line in enumerate(code_lines):
+        if line.startswith("@"):
+            code_lines[line_index], example_states = line[1:].split("$", 1)
+            break
+    else:
+        return False
+    code_snippet = "\n".join(code_lines).replace("?", answer, 1)
+    try:
+        with snippet_budget(max_steps, max_seconds):
+            return any(states_match(example_states, states) for states in get_states_at_line(code_snippet, line_index))
+    except (BudgetExceeded, Exception):
+        return False
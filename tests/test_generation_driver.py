@@ -0,0 +1,107 @@
+import os
+import sys
+import gzip
+import importlib
+import multiprocessing
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "step_operator_prediction"))
+
+from tinypy_generation_driver import TaskRun, merge_shards
+
+# snippets giving several examples, with a failing snippet, a snippet going over its step budget and a duplicate (up to whitespace)
+SNIPPETS = [snippet.format(k=k) for k in range(6) for snippet in (
+    "a = {k}\nb = a + 2\nif b > 3:\n    b = b - 1",
+    "x = {k}\nfor i in range(3):\n    x = x * i + 1",
+    "s = 'x  y'\nt = s * {k}\nu = len(t) - 2",
+    "k = {k} + 7\nwhile k > 1:\n    k = k // 2\n    k = k - 0",
+)]
+SNIPPETS[5:5] = ["c = y + 1", "n = 0\nwhile n < 10000:\n    n = n + 1", "a  =  1\nb = a + 2\nif b > 3:\n    b = b - 1"]
+
+# the workers only get the hyperparameters patched by the tests when they are forked
+needs_fork = pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="the workers need the fork start method")
+
+
+@pytest.fixture
+def script(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "snippets.txt").write_text("\n\n".join(SNIPPETS))
+    script = importlib.import_module("step_operator_prediction")
+    hyperparameters = {"source_file_path": "snippets.txt", "destination_file_path": "dataset.txt", "log_file_path": "log.txt",
+                       "max_snippet_steps": 1000, "deduplicate_snippets": True, "workers": 1}
+    for name, value in hyperparameters.items():
+        monkeypatch.setattr(script, name, value)
+    return script
+
+
+def generate(script, monkeypatch, arguments=(), **overrides):
+    # run the script with some of its hyperparameters overridden
+    with monkeypatch.context() as patch:
+        for name, value in overrides.items():
+            patch.setattr(script, name, value)
+        TaskRun(script.__name__).run(list(arguments))
+
+
+def read_dataset(destination_file_path="dataset.txt", log_file_path="log.txt"):
+    # the text of a dataset (decompressed) and of its log
+    with (gzip.open if destination_file_path.endswith(".gz") else open)(destination_file_path, "rb") as f:
+        dataset = f.read()
+    with open(log_file_path, "rb") as f:
+        return dataset, f.read()
+
+
+@pytest.fixture
+def serial(script, monkeypatch):
+    # the dataset and the log of a serial run streaming the snippets, every run below must write them byte for byte
+    generate(script, monkeypatch, destination_file_path="serial.txt", log_file_path="serial_log.txt")
+    dataset, log = read_dataset("serial.txt", "serial_log.txt")
+    assert dataset and b" 0 over_budget" in log and b" 0 duplicate" in log
+    return dataset, log
+
+
+def test_snippet_index(script, monkeypatch, serial):
+    generate(script, monkeypatch, snippet_index_path="snippets.txt.idx")
+    assert read_dataset() == serial
+
+
+def test_compressed_files(script, monkeypatch, serial):
+    with open("snippets.txt", "rb") as source, gzip.open("snippets.txt.gz", "wb") as compressed:
+        compressed.write(source.read())
+    generate(script, monkeypatch, source_file_path="snippets.txt.gz", destination_file_path="dataset.txt.gz")
+    assert read_dataset("dataset.txt.gz") == serial
+
+
+def test_output_shards(script, monkeypatch, serial):
+    generate(script, monkeypatch, output_shards=3)
+    merge_shards("dataset.txt", 3)
+    assert read_dataset() == serial
+
+
+def test_node_shards(script, monkeypatch, serial):
+    for shard in range(4):
+        generate(script, monkeypatch, ["--shard", f"{shard}/4"], destination_file_path="dataset.txt.gz")
+    merge_shards("dataset.txt.gz", 4)
+    assert read_dataset("dataset.txt.gz") == serial
+
+
+def test_rejection_index_and_trace_store(script, monkeypatch, serial):
+    # the second run reads the rejected snippets and the runs of the others from the sqlite files written by the first one
+    for _ in range(2):
+        generate(script, monkeypatch, rejection_index_path="rejections.sqlite", trace_store_path="traces.sqlite")
+        assert read_dataset() == serial
+
+
+@needs_fork
+def test_workers(script, monkeypatch, serial):
+    generate(script, monkeypatch, workers=2, chunk_size=3)
+    assert read_dataset() == serial
+    # two shards written by two worker processes
+    generate(script, monkeypatch, workers=2, chunk_size=3, output_shards=2)
+    merge_shards("dataset.txt", 2)
+    assert read_dataset() == serial
+
+
+@needs_fork
+def test_sandboxed_workers(script, monkeypatch, serial):
+    generate(script, monkeypatch, workers=2, sandboxed_workers=True, snippets_per_worker=5)
+    assert read_dataset() == serial
@@ -0,0 +1,72 @@
+import os
+import sys
+import pickle
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "line_execution_counting"))
+
+import line_execution_counting
+import tinypy_code_tracer_engine
+from tinypy_generation_driver import TaskRun
+
+
+SNIPPETS = ["a = 1\nb = a + 1", "c = 2\nif c > 1:\n    c = 0"]
+# snippets without any statement, sys.settrace reports a single line for them
+EMPTY_SNIPPETS = ["", "# c", "\n\n", "# c\n\n# d\n"]
+
+
+def test_instrumented_counts_match_the_traced_ones():
+    for snippet in SNIPPETS:
+        assert line_execution_counting.instrumented_line_counter(snippet) == line_execution_counting.line_counter(snippet)
+
+
+@pytest.mark.parametrize("snippet", EMPTY_SNIPPETS)
+def test_empty_snippets_are_not_instrumented(snippet):
+    assert line_execution_counting.compile_instrumented(snippet) is None
+    assert line_execution_counting.instrumented_line_counter(snippet) == line_execution_counting.line_counter(snippet) == 1
+
+
+@pytest.mark.parametrize("snippet", EMPTY_SNIPPETS)
+def test_empty_snippets_are_not_interpreted(snippet):
+    assert line_execution_counting.compile_tinypy(snippet) is None
+    assert line_execution_counting.interpreter_line_counter(snippet) == line_execution_counting.line_counter(snippet) == 1
+
+
+@pytest.mark.parametrize("snippet", EMPTY_SNIPPETS)
+def test_empty_snippets_are_left_to_settrace(snippet):
+    assert not tinypy_code_tracer_engine.has_monitored_line_events(compile(snippet, "<string>", "exec"))
+
+
+@pytest.mark.skipif(not hasattr(sys, "monitoring"), reason="sys.monitoring needs python 3.12+")
+@pytest.mark.parametrize("snippet", EMPTY_SNIPPETS + SNIPPETS)
+def test_monitoring_counts_match_the_settrace_ones(snippet, monkeypatch):
+    monkeypatch.setattr(line_execution_counting, "tracing_backend", "settrace")
+    count = line_execution_counting.line_counter(snippet)
+    for backend in ("monitoring", "auto"):
+        monkeypatch.setattr(line_execution_counting, "tracing_backend", backend)
+        assert line_execution_counting.line_counter(snippet) == count
+
+
+def test_prepare_run_returns_the_auto_decision(monkeypatch):
+    # the decision is returned for the driver to send to the workers, the module itself is left as it was
+    monkeypatch.setattr(line_execution_counting, "line_counting_mode", "auto")
+    assert line_execution_counting.prepare_run(iter(SNIPPETS)) == {"instrumented_counts_rejected": False}
+    monkeypatch.setattr(line_execution_counting, "instrumented_line_counter", lambda code_snippet: -1)
+    assert line_execution_counting.prepare_run(iter(SNIPPETS)) == {"instrumented_counts_rejected": True}
+    assert not line_execution_counting.instrumented_counts_rejected
+    monkeypatch.setattr(line_execution_counting, "line_counting_mode", "traced")
+    assert line_execution_counting.prepare_run(iter(SNIPPETS)) == {}
+
+
+def test_prepared_hyperparameters_reach_the_workers(monkeypatch):
+    # a worker started with spawn or forkserver only gets the pickled TaskRun, not the globals of the parent
+    monkeypatch.setattr(line_execution_counting, "line_counting_mode", "auto")
+    run = TaskRun("line_execution_counting")
+    run.prepared_hyperparameters[""] = {"instrumented_counts_rejected": True}
+    worker_run = pickle.loads(pickle.dumps(run))
+    with worker_run.configure("", line_execution_counting, {}):
+        assert line_execution_counting.instrumented_counts_rejected
+        assert line_execution_counting.count_executed_lines(SNIPPETS[0]) == line_execution_counting.line_counter(SNIPPETS[0])
+    assert not line_execution_counting.instrumented_counts_rejected
+    with worker_run.configure("", line_execution_counting, {"instrumented_counts_rejected": False}):
+        assert not line_execution_counting.instrumented_counts_rejected
@@ -0,0 +1,35 @@
+import os
+import sys
+import signal
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "step_operator_prediction"))
+
+import tinypy_code_tracer_engine
+from tinypy_code_tracer_engine import BudgetExceeded, snippet_budget
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="the time budget needs SIGALRM")
+
+
+def test_time_budget_stops_exec():
+    with pytest.raises(BudgetExceeded):
+        with snippet_budget(max_seconds=0.05):
+            exec("while True:\n    pass", {})
+
+
+def test_alarm_after_the_block_is_ignored(monkeypatch):
+    # the timer goes off once the block is over, right before snippet_budget() disarms it
+    setitimer = signal.setitimer
+    def late_setitimer(which, seconds, *interval):
+        if seconds == 0:
+            signal.raise_signal(signal.SIGALRM)
+        return setitimer(which, seconds, *interval)
+    with snippet_budget(max_seconds=60):
+        monkeypatch.setattr(tinypy_code_tracer_engine.signal, "setitimer", late_setitimer)
+    monkeypatch.undo()
+    assert tinypy_code_tracer_engine.active_budget is None
+    assert signal.getsignal(signal.SIGALRM) is not tinypy_code_tracer_engine.on_budget_alarm
+
+
+def test_alarm_outside_of_a_budget_is_ignored():
+    tinypy_code_tracer_engine.on_budget_alarm(signal.SIGALRM, None)
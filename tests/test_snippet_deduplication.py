@@ -0,0 +1,85 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "output_prediction"))
+
+import tinypy_generation_driver
+from tinypy_generation_driver import SnippetDeduplicator, SnippetCorpus, normalize_snippet, get_first_occurrences, get_snippet_dedup_index, process_in_order
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_whitespace_differences_are_duplicates(on_disk):
+    deduplicator = SnippetDeduplicator(on_disk=on_disk)
+    assert not deduplicator.seen("a = 1\nb = a + 2\nprint(b)")
+    assert deduplicator.seen("a  =  1\r\n\n\nb = a +\t2   \nprint(b)\n")
+    assert deduplicator.duplicates == 1
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_string_literals_are_kept(on_disk):
+    # the two snippets only differ inside a string literal, and print different things
+    deduplicator = SnippetDeduplicator(on_disk=on_disk)
+    assert not deduplicator.seen("s = 'a  b'\nprint(s)")
+    assert not deduplicator.seen("s = 'a b'\nprint(s)")
+    assert not deduplicator.seen('s = """a\n\n   b   \n"""\nprint(s)')
+    assert not deduplicator.seen('s = """a\n   b\n"""\nprint(s)')
+    assert not deduplicator.seen("n = 1\nprint(f'{n}  x')")
+    assert not deduplicator.seen("n = 1\nprint(f'{n} x')")
+    assert deduplicator.duplicates == 0
+
+
+def test_normalize_snippet():
+    assert normalize_snippet("s  =  'a  b'   \r\n\nprint( s )") == "s = 'a  b'\nprint( s )"
+    assert normalize_snippet("if x:\n    y  =  1\n") == "if x:\n    y = 1"
+    # a snippet that does not tokenize is left as it is, up to its line endings
+    assert normalize_snippet("s = 'a  b\r\nprint(s)") == "s = 'a  b\nprint(s)"
+
+
+# snippets 2 and 4 repeat snippet 0, snippet 5 repeats snippet 3
+CORPUS = ["a = 1\nb = a", "c = 'x  y'", "a  =  1\nb = a   ", "c = 'x y'", "a = 1\nb  =  a", "c = 'x y'"]
+
+
+def get_index(index, snippet):
+    return index
+
+
+def get_duplicate(index, snippet):
+    return ("duplicate", index, snippet)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / "snippets.txt"
+    path.write_text("\n\n".join(CORPUS))
+    with SnippetCorpus(str(path)) as corpus:
+        yield corpus
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_first_occurrences(corpus, on_disk):
+    assert list(get_first_occurrences(corpus, on_disk)) == [0, 1, 0, 3, 0, 3]
+    assert list(get_first_occurrences(corpus.select(2, 5), on_disk)) == [0, 3, 0]
+
+
+def test_shards_read_the_dedup_index(corpus, monkeypatch):
+    # once the dedup index is built, a shard does not normalize any snippet, the ones before it included
+    get_snippet_dedup_index(corpus)
+    monkeypatch.setattr(tinypy_generation_driver, "normalize_snippet", None)
+    expected = [1, ("duplicate", 2, corpus[2]), 3, ("duplicate", 4, corpus[4])]
+    results = process_in_order(get_index, corpus.select(1, 5), deduplicator=SnippetDeduplicator(), duplicate_result=get_duplicate)
+    assert list(results) == expected
+
+
+def test_outdated_dedup_index_is_rebuilt(corpus, tmp_path):
+    get_snippet_dedup_index(corpus)
+    path = tmp_path / "snippets.txt"
+    path.write_text("\n\n".join(CORPUS[1:]))
+    with SnippetCorpus(str(path)) as changed_corpus:
+        assert list(get_first_occurrences(changed_corpus)) == [0, 1, 2, 1, 2]
+
+
+def test_corpus_and_stream_drop_the_same_snippets(corpus):
+    streamed = process_in_order(get_index, iter(CORPUS), deduplicator=SnippetDeduplicator(), duplicate_result=get_duplicate)
+    indexed = process_in_order(get_index, corpus, deduplicator=SnippetDeduplicator(), duplicate_result=get_duplicate)
+    assert list(streamed) == list(indexed)
@@ -0,0 +1,28 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "step_operator_prediction"))
+
+import step_operator_prediction
+
+
+CODE = "a = 1\nb = a + 2\nc = b * 2"
+
+
+@pytest.fixture(params=["interpreter", "generator", "traced"])
+def engine(request, monkeypatch):
+    monkeypatch.setattr(step_operator_prediction, "step_capture_engine", request.param)
+    return request.param
+
+
+def test_variable_values_at_step(engine):
+    # the states and the highlighted line of a step are the same with every step capture engine
+    assert step_operator_prediction.get_variable_values_from_code_step(CODE, 3, step_operator_prediction.stack) == ("a?1;b?3", 2)
+    assert step_operator_prediction.get_variable_values_from_code_step(CODE, 10, step_operator_prediction.stack) == ("", -2)
+
+
+def test_is_deterministic(engine):
+    # "a + 2" replaced by "a - 2" changes the states of step 3, "a + 0" replaced by "a - 0" does not
+    assert step_operator_prediction.is_deterministic(CODE, 6, 1, ["-"], "a?1;b?3", 2, 3, step_operator_prediction.stack)
+    assert not step_operator_prediction.is_deterministic("a = 0\nb = a + 0\nc = b", 6, 1, ["-"], "a?0;b?0", 2, 3, step_operator_prediction.stack)
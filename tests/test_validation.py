@@ -0,0 +1,62 @@
+import os
+import sys
+import importlib
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SCRIPTS = {
+    "line_execution_counting": ("line_execution_counting", "line_counting_mode", ["interpreter", "auto", "instrumented", "traced"]),
+    "operator_prediction": ("operator_prediction", "execution_engine", ["cpython", "interpreter"]),
+    "output_prediction": ("output_prediction", "execution_engine", ["cpython", "interpreter"]),
+    "stepped_input_prediction": ("step_input_prediction", "step_capture_engine", ["interpreter", "generator", "traced"]),
+    "step_operator_prediction": ("step_operator_prediction", "step_capture_engine", ["interpreter", "generator", "traced"]),
+}
+for _, (directory, _, _) in SCRIPTS.items():
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+# snippets whose lambda or comprehension reads a top-level variable, they only run with a single namespace
+LAMBDA_SNIPPET = "a = 2\nf = lambda v: v + a\nb = f(3)"
+COMPREHENSION_SNIPPET = "n = 3\nc = [i * n for i in range(2)]\nd = c[1]"
+# snippet calling a builtin through a variable, outside of the tinypy subset
+CALL_SNIPPET = "f = abs\nb = f(-1)\nc = b + 1"
+
+
+@pytest.fixture(params=[(name, engine) for name, (_, _, engines) in SCRIPTS.items() for engine in engines], ids="-".join)
+def script(request, monkeypatch):
+    name, engine = request.param
+    module = importlib.import_module(name)
+    monkeypatch.setattr(module, SCRIPTS[name][1], engine)
+    return module
+
+
+@pytest.mark.parametrize("snippet", [LAMBDA_SNIPPET, COMPREHENSION_SNIPPET])
+def test_closures_read_top_level_variables(script, snippet):
+    script.validate_snippet(snippet)
+
+
+def test_call_through_a_variable(script):
+    script.validate_snippet(CALL_SNIPPET)
+
+
+def test_unbound_name_is_rejected(script):
+    with pytest.raises(NameError):
+        script.validate_snippet("x = y + 1")
+
+
+@pytest.mark.parametrize("snippet", [LAMBDA_SNIPPET, COMPREHENSION_SNIPPET])
+def test_line_counts(snippet, monkeypatch):
+    # the expected count is the one of sys.settrace, python 3.12+ inlining the comprehensions (6 lines on 3.11, 5 on 3.12+)
+    line_execution_counting = importlib.import_module("line_execution_counting")
+    with monkeypatch.context() as patch:
+        patch.setattr(line_execution_counting, "tracing_backend", "settrace")
+        count = line_execution_counting.line_counter(snippet)
+    assert line_execution_counting.generate_examples(0, snippet) == [snippet + f"\n# count?{count}"]
+
+
+@pytest.mark.parametrize("mode", ["interpreter", "auto", "instrumented"])
+def test_call_through_a_variable_line_counts(mode, monkeypatch):
+    line_execution_counting = importlib.import_module("line_execution_counting")
+    monkeypatch.setattr(line_execution_counting, "line_counting_mode", "traced")
+    traced = line_execution_counting.generate_examples(0, CALL_SNIPPET)
+    monkeypatch.setattr(line_execution_counting, "line_counting_mode", mode)
+    assert line_execution_counting.generate_examples(0, CALL_SNIPPET) == traced == [CALL_SNIPPET + "\n# count?3"]